@@ -0,0 +1,142 @@
+# Headless batch mode: computes margins for every 1C sales report in a directory without the GUI.
+# python batch.py REPORTS_DIR [-o OUTPUT_DIR [--format xlsx|csv|parquet] | --combined FILE] [--db test_db.sqlite]
+#                 [--rate RATE] [--as-of YYYY-MM-DD] [--workers N] [--timings-log FILE]
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import timings
+from db_interface import DBInterface
+from exporters import export_rows, export_sheets_to_xlsx
+from report_cache import ReportCache
+from sales_store import SalesStore, aggregate_sales, read_sales_from_excel
+
+# item_code -> cost_usd, loaded once by the parent and handed to every worker process on start
+_items_costs = {}
+
+
+def init_worker(items_costs, timings_log=None):
+    global _items_costs
+    _items_costs = items_costs
+    if timings_log:
+        timings.enable(timings_log)
+
+
+def process_report(excel_filepath, usd_rub_rate, output_filepath=None, cache_dir=None):
+    with timings.stage('process report') as report_stage:
+        if cache_dir:
+            sales_store = ReportCache(cache_dir).read_sales_from_excel(excel_filepath)
+        else:
+            sales_store = read_sales_from_excel(excel_filepath)
+        report_stage.rows = len(sales_store)
+        with timings.stage('apply costs'):
+            # the costs are keyed by the database's text codes, numeric report codes are looked up as text
+            sales_store.apply_costs([(item_code, _items_costs[item_code])
+                                     for item_code in map(str, sales_store['item_code'].tolist())
+                                     if item_code in _items_costs], usd_rub_rate)
+        if output_filepath:
+            with timings.stage('export report'):
+                export_rows(output_filepath, SalesStore.ru_col_names, sales_store.iter_row_batches(),
+                            SalesStore.col_types)
+            return len(sales_store), None
+        return len(sales_store), sales_store
+
+
+def find_reports(reports_dir):
+    return sorted(os.path.join(reports_dir, name) for name in os.listdir(reports_dir)
+                  if name.lower().endswith('.xlsx') and not name.startswith('~$'))
+
+
+def sheet_names(reports, reserved=()):
+    names = {}
+    used = set(reserved)
+    for report in reports:
+        base = os.path.splitext(os.path.basename(report))[0][:31]
+        name, number = base, 1
+        while name in used:
+            number += 1
+            name = f'{base[:31 - len(str(number)) - 1]}_{number}'
+        used.add(name)
+        names[report] = name
+    return names
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Compute margins for a directory of 1C sales reports.')
+    parser.add_argument('reports_dir')
+    parser.add_argument('-o', '--output-dir', help='one <report>_margin file per report (default: REPORTS_DIR/margins)')
+    parser.add_argument('--format', choices=['xlsx', 'csv', 'parquet'], default='xlsx',
+                        help='format of the per-report files')
+    parser.add_argument('--combined', help='write all reports into one workbook, one sheet per report '
+                                           'plus a totals sheet merged by item code')
+    parser.add_argument('--db', default='test_db.sqlite')
+    parser.add_argument('--rate', type=float, help='USD exchange rate (default: the one saved in the database)')
+    parser.add_argument('--as-of', help='use the costs and exchange rate in effect on this date (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, help='number of processes (default: CPU count)')
+    parser.add_argument('--cache-dir', default='report_cache', help='parsed report cache, empty string disables it')
+    parser.add_argument('--timings-log', help='append per-stage timings of every process to this JSON lines file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    reports = find_reports(args.reports_dir)
+    if not reports:
+        print(f'No .xlsx reports in {args.reports_dir}', file=sys.stderr)
+        return 1
+
+    if args.timings_log:
+        timings.enable(args.timings_log)
+    db = DBInterface(args.db)
+    usd_rub_rate = args.rate if args.rate is not None else db.get_usd_exchange_rate(args.as_of)
+    if args.as_of:
+        items_costs = dict(db.get_costs_as_of(args.as_of))
+    else:
+        items_costs = dict(db.get_costs_from_db())
+    db.close()
+
+    output_dir = None
+    if not args.combined:
+        output_dir = args.output_dir or os.path.join(args.reports_dir, 'margins')
+        os.makedirs(output_dir, exist_ok=True)
+
+    stores = {}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(items_costs, args.timings_log)) as pool:
+        futures = {}
+        for report in reports:
+            output_filepath = None
+            if output_dir:
+                output_filepath = os.path.join(
+                    output_dir, os.path.splitext(os.path.basename(report))[0] + '_margin.' + args.format)
+            futures[pool.submit(process_report, report, usd_rub_rate, output_filepath, args.cache_dir)] = report
+
+        for future in as_completed(futures):
+            report = futures[future]
+            try:
+                rows, sales_store = future.result()
+            except Exception as error:
+                failed += 1
+                print(f'{report}: error: {error}', file=sys.stderr)
+                continue
+            if sales_store is not None:
+                stores[report] = sales_store
+            print(f'{report}: {rows} rows')
+
+    if args.combined and stores:
+        totals_sheet_name = 'Итого'
+        names = sheet_names(reports, reserved=(totals_sheet_name,))
+        totals = aggregate_sales([stores[report] for report in reports if report in stores], usd_rub_rate=usd_rub_rate)
+        sheets = [(totals_sheet_name, SalesStore.ru_col_names, totals.iter_row_batches())]
+        sheets += [(names[report], SalesStore.ru_col_names, stores[report].iter_row_batches())
+                   for report in reports if report in stores]
+        with timings.stage('export combined workbook'):
+            export_sheets_to_xlsx(args.combined, sheets)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
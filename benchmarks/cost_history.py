@@ -0,0 +1,44 @@
+# As-of cost lookup benchmark over a versioned cost history.
+# Run from the repository root: python -m benchmarks.cost_history [items] [dates] [lookup_codes]
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.generators import make_costs
+from db_interface import DBInterface
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    dates = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    lookup_codes = int(sys.argv[3]) if len(sys.argv) > 3 else 100_000
+    rng = np.random.default_rng(0)
+    costs = make_costs(items)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DBInterface(os.path.join(tmp_dir, 'history.sqlite'))
+        started = time.perf_counter()
+        for month in range(dates):
+            prices = rng.uniform(1, 100, items).round(2).tolist()
+            db.import_costs_to_db(((item[0], price) for item, price in zip(costs, prices)),
+                                  effective_date=f'2023-{month + 1:02d}-01')
+        history_rows = db.db_cursor.execute("SELECT COUNT(*) FROM items_cost_history").fetchone()[0]
+        print(f'{history_rows} history rows written by {dates} dated imports in {time.perf_counter() - started:.2f}s')
+
+        codes = [costs[row][0] for row in rng.choice(items, min(lookup_codes, items), replace=False)]
+        as_of_date = f'2023-{dates // 2 + 1:02d}-15'
+        started = time.perf_counter()
+        found = db.get_costs_as_of(as_of_date, codes)
+        print(f'as-of {as_of_date} for {len(codes)} codes: {len(found)} costs in {time.perf_counter() - started:.3f}s')
+
+        started = time.perf_counter()
+        found = db.get_costs_as_of(as_of_date)
+        print(f'as-of {as_of_date} for all items: {len(found)} costs in {time.perf_counter() - started:.3f}s')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Cost import benchmark: bulk staging-table upsert vs. the old row-by-row upsert.
+# Run from the repository root: python -m benchmarks.cost_import [rows ...]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import changed_costs, make_costs
+from db_interface import DBInterface
+
+
+def row_by_row_import(db_filename, list_of_items):
+    con = sqlite3.connect(db_filename)
+    cursor = con.cursor()
+    for item in list_of_items:
+        cursor.execute("""INSERT INTO items_cost(item_code, cost) VALUES (:item_code, :cost)
+                          ON CONFLICT (item_code) DO UPDATE SET cost = :cost""",
+                       {'item_code': item[0], 'cost': item[1]})
+    con.commit()
+    con.close()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def counts(import_result):
+    return {key: value for key, value in import_result.items() if key != 'changed'}
+
+
+def run(rows, with_row_by_row):
+    costs = make_costs(rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DBInterface(os.path.join(tmp_dir, 'bulk.sqlite'))
+        first_time, first_result = timed(db.import_costs_to_db, costs)
+        again_time, again_result = timed(db.import_costs_to_db, changed_costs(costs))
+        same_time, same_result = timed(db.import_costs_to_db, changed_costs(costs))
+        print(f'{rows} rows bulk: fresh {first_time:.3f}s {counts(first_result)}, '
+              f're-import {again_time:.3f}s {counts(again_result)}, '
+              f'unchanged re-import {same_time:.3f}s {counts(same_result)}')
+
+        if with_row_by_row:
+            db_filename = os.path.join(tmp_dir, 'row_by_row.sqlite')
+            DBInterface(db_filename)
+            row_time, _ = timed(row_by_row_import, db_filename, costs)
+            print(f'{rows} rows row by row: fresh {row_time:.3f}s')
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for rows in sizes:
+        run(rows, with_row_by_row=rows <= 100_000)
+
+
+if __name__ == '__main__':
+    main()
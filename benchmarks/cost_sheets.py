@@ -0,0 +1,41 @@
+# Multi-file cost import: the same price books read by one process and by a process per sheet,
+# then written to SQLite in one import. Total time should drop with the number of cores.
+# Run from the repository root: python -m benchmarks.cost_sheets [files] [sheets per file] [rows per file]
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import write_costs_sheet
+from cost_sheets import read_costs_files
+from db_interface import DBInterface
+
+
+def run(filepaths, db_filename, workers):
+    started = time.perf_counter()
+    rows, sheets = read_costs_files(filepaths, workers)
+    db = DBInterface(db_filename)
+    import_result = db.import_costs_to_db(rows)
+    db.close()
+    return time.perf_counter() - started, import_result['inserted'], len(sheets)
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sheets = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 50_000
+    cores = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepaths = [os.path.join(tmp_dir, f'costs_{number}.xlsx') for number in range(files)]
+        for number, filepath in enumerate(filepaths):
+            write_costs_sheet(filepath, rows, seed=number, sheets=sheets)
+        for workers in sorted({1, cores}):
+            seconds, inserted, sheet_count = run(filepaths, os.path.join(tmp_dir, f'{workers}.sqlite'), workers)
+            print(f'{workers:3} workers: {seconds:7.2f}s for {files} files, {sheet_count} sheets, '
+                  f'{inserted} costs inserted')
+    if cores == 1:
+        print('one core available, the parallel run was skipped')
+
+
+if __name__ == '__main__':
+    main()
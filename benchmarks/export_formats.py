@@ -0,0 +1,54 @@
+# Cost export benchmark: streamed xlsx/csv/parquet vs. the old fetchall + DataFrame.to_excel path.
+# The database is built and every format runs in its own process, so peak RSS is comparable
+# (on Linux a child started from a big parent inherits the parent's peak RSS).
+# Run from the repository root: python -m benchmarks.export_formats [rows]
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import make_costs
+from db_interface import DBInterface
+
+formats = ['xlsx', 'csv', 'parquet', 'pandas_xlsx']
+
+
+def export(db_filename, export_format, out_dir):
+    db = DBInterface(db_filename)
+    started = time.perf_counter()
+    if export_format == 'pandas_xlsx':
+        import pandas as pd
+        filepath = os.path.join(out_dir, 'costs_pandas.xlsx')
+        pd.DataFrame(db.get_costs_from_db(), columns=["Артикул", "Цена"]).to_excel(filepath, index=False)
+    else:
+        filepath = os.path.join(out_dir, 'costs.' + export_format)
+        db.export_costs_to_file(filepath)
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    size_mb = os.path.getsize(filepath) / 2 ** 20
+    print(f'{export_format:12} {elapsed:8.2f}s  peak RSS {peak_mb:6.0f}MB  file {size_mb:6.1f}MB')
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--make-db':
+        DBInterface(sys.argv[2]).import_costs_to_db(make_costs(int(sys.argv[3])))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--export':
+        export(*sys.argv[2:])
+        return
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_filename = os.path.join(tmp_dir, 'costs.sqlite')
+        subprocess.run([sys.executable, '-m', 'benchmarks.export_formats', '--make-db', db_filename, str(rows)],
+                       check=True)
+        print(f'{rows} cost rows')
+        for export_format in formats:
+            subprocess.run([sys.executable, '-m', 'benchmarks.export_formats', '--export',
+                            db_filename, export_format, tmp_dir], check=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Synthetic inputs for the benchmarks: 1C-style sales reports, cost sheets and cost databases.
+# Sales item codes overlap the generated costs ('A%07d'), so filling costs finds most of them.
+# Run from the repository root to write files by hand:
+# python -m benchmarks.generators report|costs|db PATH ROWS
+import sys
+
+import numpy as np
+
+from db_interface import DBInterface
+
+
+def make_costs(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return list(zip(['A%07d' % i for i in rng.permutation(rows)], rng.uniform(1, 100, rows).round(2).tolist()))
+
+
+def changed_costs(costs, share=0.1, seed=1):
+    rng = np.random.default_rng(seed)
+    changed = list(costs)
+    for row in rng.choice(len(costs), int(len(costs) * share), replace=False):
+        changed[row] = (changed[row][0], changed[row][1] + 1)
+    return changed
+
+
+def make_sales(rows, seed=0, unknown_share=0.05):
+    # (name, item_code, qty, sum) rows; some items sold nothing, some are missing from the costs
+    rng = np.random.default_rng(seed)
+    codes = ['A%07d' % i for i in rng.permutation(rows)]
+    for row in rng.choice(rows, int(rows * unknown_share), replace=False):
+        codes[row] = 'N%07d' % row
+    sold_qty = rng.integers(0, 50, rows)
+    sold_qty[rng.random(rows) < 0.02] = 0
+    sold_sum = (sold_qty * rng.uniform(100, 5000, rows)).round(2)
+    return [(f'Товар {code}', code, int(qty), float(amount) if qty else None)
+            for code, qty, amount in zip(codes, sold_qty.tolist(), sold_sum.tolist())]
+
+
+def write_sales_report(filepath, rows, seed=0, units_column=False, styled_tail_rows=0):
+    # Laid out like a 1C "Продажи" export: a preamble with the report title, period and filters,
+    # the "Номенклатура" header with a units row under it, the items, then the "Итого" footer.
+    # units_column adds an "Ед" header over a column left empty, styled_tail_rows adds formatted
+    # but empty rows after the footer, as some 1C exports have.
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    sales = make_sales(rows, seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('TDSheet')
+
+    def append(row):
+        if units_column:
+            row = list(row[:1]) + [None] + list(row[1:])
+        sheet.append(row)
+
+    sheet.append(['Продажи'])
+    sheet.append(['Период: 01.01.2023 - 31.12.2023'])
+    sheet.append(['Отбор: Организация Равно "Лофт"'])
+    sheet.append([])
+    sheet.append(['Номенклатура', 'Ед', 'Артикул', 'Количество', 'Сумма'] if units_column else
+                 ['Номенклатура', 'Артикул', 'Количество', 'Сумма'])
+    append([None, None, 'шт', 'руб'])
+    for row in sales:
+        append(row)
+    append(['Итого', None, sum(row[2] for row in sales), sum(row[3] or 0 for row in sales)])
+    for _ in range(styled_tail_rows):
+        cell = WriteOnlyCell(sheet)
+        cell.font = Font(bold=True)
+        sheet.append([cell, cell, cell, cell])
+    workbook.save(filepath)
+    return sales
+
+
+def write_costs_sheet(filepath, rows, seed=0, sheets=1):
+    # the layout the costs page imports: item code and usd cost under a header row,
+    # split over several sheets like a supplier price book when sheets > 1
+    from openpyxl import Workbook
+
+    costs = make_costs(rows, seed)
+    workbook = Workbook(write_only=True)
+    for number in range(sheets):
+        sheet = workbook.create_sheet('Себестоимость' if number == 0 else f'Себестоимость {number + 1}')
+        sheet.append(['Артикул', 'Себестоимость USD'])
+        for row in costs[number * rows // sheets:(number + 1) * rows // sheets]:
+            sheet.append(row)
+    workbook.save(filepath)
+    return costs
+
+
+def make_cost_db(filepath, rows, seed=0, usd_rub_rate=90):
+    db = DBInterface(filepath)
+    db.import_costs_to_db(make_costs(rows, seed))
+    db.set_usd_exchange_rate(usd_rub_rate)
+    db.close()
+    return filepath
+
+
+def main():
+    kind, filepath, rows = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    if kind == 'report':
+        write_sales_report(filepath, rows)
+    elif kind == 'costs':
+        write_costs_sheet(filepath, rows)
+    elif kind == 'db':
+        make_cost_db(filepath, rows)
+    else:
+        sys.exit(f'Unknown kind: {kind}')
+
+
+if __name__ == '__main__':
+    main()
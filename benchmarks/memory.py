@@ -0,0 +1,87 @@
+# Memory per sales row: the old dict-backed LoftItem, the slotted LoftItem and the SalesStore
+# columns, plus the cost of the cell accessor the table view calls for every painted cell.
+# Run from the repository root: python -m benchmarks.memory [rows]
+import gc
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.generators import make_sales
+from main import LoftItem
+from sales_store import SalesStore
+
+
+class DictLoftItem:
+    # LoftItem before __slots__, with its per-instance __dict__ and unused image field
+    def __init__(self, item_code, sold_qty, sold_sum):
+        self.cost_usd = 0
+        self.cost_rub = 0
+        self.item_code = item_code
+        self.sold_qty = sold_qty
+        if sold_qty:
+            self.sold_price = sold_sum / sold_qty
+        else:
+            self.sold_price = 0
+        self.sold_sum = sold_sum
+        self.margin_rub = 0
+        self.margin_pct = 0
+        self.image = None
+
+
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def old_value(store, row, column):
+    value = store.columns[store.col_names[column]][row]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def time_cells(value, store, cells):
+    rows = np.random.default_rng(0).integers(0, len(store), cells).tolist()
+    started = time.perf_counter()
+    for row in rows:
+        for column in range(len(store.col_names)):
+            value(store, row, column)
+    return time.perf_counter() - started
+
+
+def store_from(sales):
+    store = SalesStore()
+    item_codes, sold_qty, sold_sum = zip(*sales)
+    store.append(item_codes, sold_qty, sold_sum)
+    return store
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    # item codes and amounts exist before measuring, only what each representation adds is counted
+    sales = [(item_code, qty, amount or 0.0) for _, item_code, qty, amount in make_sales(rows)]
+
+    for name, build in (
+            ('LoftItem with __dict__', lambda: [DictLoftItem(*row) for row in sales]),
+            ('LoftItem with __slots__', lambda: [LoftItem(*row) for row in sales]),
+            ('SalesStore columns', lambda: store_from(sales))):
+        result, size, elapsed = traced(build)
+        print(f'{name:24} {size / 2 ** 20:8.1f}MB  {size / rows:6.0f} bytes/row  built in {elapsed:.2f}s')
+        del result
+
+    store = store_from(sales)
+    cells = 100_000
+    for name, value in (('old value()', old_value), ('SalesStore.value', SalesStore.value)):
+        print(f'{name:24} {time_cells(value, store, cells):8.3f}s for {cells} rows x {len(store.col_names)} cells')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Parser parity check: read_sales_from_excel against the pandas parser it replaced, on every
+# generated report layout. Exits with 1 when any layout parses differently.
+# Run from the repository root: python -m benchmarks.report_parity [rows]
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.generators import write_sales_report
+from sales_store import read_sales_from_excel
+
+layouts = {
+    'plain': {},
+    'units column': {'units_column': True},
+    'styled tail rows': {'styled_tail_rows': 12},
+    'both': {'units_column': True, 'styled_tail_rows': 12},
+}
+
+
+def old_read_sales_from_excel(excel_filepath):
+    # LoftItemTableModel.read_sales_from_excel before the streaming parser, returning its items
+    df = pd.read_excel(excel_filepath)
+
+    start_trigger_value = "Номенклатура"
+    countdown_trigger = False
+
+    for item in df.iloc:
+        if item[0] == start_trigger_value:
+            countdown_trigger = True
+            continue
+        if countdown_trigger and (not pd.isna(item[0])):
+            df.drop(range(0, item.name), axis=0, inplace=True)
+            break
+
+    for item in df.tail(10).iloc:
+        if item[0] == 'Итого':
+            df.drop(item.name, axis=0, inplace=True)
+
+    df.dropna(axis=0, inplace=True, how="all")
+    df.dropna(axis=1, inplace=True, how="all")
+    df.reset_index(drop=True, inplace=True)
+    df.fillna(0, inplace=True)
+    df.sort_values(df.columns[0], axis=0, inplace=True)
+
+    return [(item[1], int(item[2]), float(item[3])) for item in df.iloc]
+
+
+def new_items(excel_filepath):
+    store = read_sales_from_excel(excel_filepath)
+    return list(zip(store['item_code'].tolist(), store['sold_qty'].tolist(), store['sold_sum'].tolist()))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, options in layouts.items():
+            filepath = os.path.join(tmp_dir, 'report.xlsx')
+            write_sales_report(filepath, rows, **options)
+            old_time, old = timed(old_read_sales_from_excel, filepath)
+            new_time, new = timed(new_items, filepath)
+            matched = old == new
+            mismatches += not matched
+            print(f'{name:18} {"same" if matched else "DIFFERENT"}: {len(old)} items old, {len(new)} new, '
+                  f'{old_time:.2f}s old, {new_time:.2f}s new')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
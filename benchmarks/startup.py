@@ -0,0 +1,64 @@
+# Cold start benchmark: time to import main and to show the first MainWindow frame.
+# Every run is a fresh interpreter started in a temporary directory with its own test_db.sqlite.
+# Run from the repository root: python -m benchmarks.startup [runs] [cost rows]
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.generators import make_costs
+from db_interface import DBInterface
+
+STARTUP_SCRIPT = """
+import json
+import sys
+import time
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+from PyQt6.QtWidgets import QApplication
+app = QApplication(sys.argv[:1])
+window = main.MainWindow()
+app.processEvents()
+shown = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - started,
+    'first_window': shown - started,
+    'heavy_modules': sorted(name for name in ('pandas', 'openpyxl', 'pyarrow') if name in sys.modules),
+}))
+"""
+
+
+def run_once(work_dir):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=work_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cost_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = DBInterface(os.path.join(work_dir, 'test_db.sqlite'))
+        db.import_costs_to_db(make_costs(cost_rows))
+        db.close()
+
+        # the first run only warms the OS file cache
+        run_once(work_dir)
+        results = [run_once(work_dir) for _ in range(runs)]
+
+    import_time = statistics.median(result['import'] for result in results)
+    window_time = statistics.median(result['first_window'] for result in results)
+    print(f'{runs} runs, {cost_rows} costs in the db: import main {import_time:.3f}s, '
+          f'first window {window_time:.3f}s (medians)')
+    print(f'heavy modules loaded at startup: {", ".join(results[-1]["heavy_modules"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
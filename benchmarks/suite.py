@@ -0,0 +1,197 @@
+# Regression suite over the synthetic inputs from benchmarks.generators. Each case is run a few
+# times with fresh state, its fastest run is compared with benchmarks/baselines.json, and the
+# exit code is 1 when a case got slower than the baseline by more than the tolerance.
+# Run from the repository root: python -m benchmarks.suite [--save] [case ...]
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtWidgets import QApplication, QTableView
+
+from benchmarks.generators import changed_costs, make_cost_db, make_costs, write_sales_report
+from benchmarks.table_models import scroll
+from db_interface import DBInterface
+from exporters import export_rows
+from main import LoftItem, LoftItemTableModel
+from sales_store import read_sales_from_excel
+
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+class Inputs:
+    # generated once per suite run, every case copies what it modifies
+    def __init__(self, tmp_dir, rows, cost_rows):
+        self.tmp_dir = tmp_dir
+        self.report = os.path.join(tmp_dir, 'report.xlsx')
+        write_sales_report(self.report, rows)
+        self.costs = make_costs(cost_rows)
+        self.db_filename = make_cost_db(os.path.join(tmp_dir, 'costs.sqlite'), cost_rows)
+        self.store = read_sales_from_excel(self.report)
+        self.runs = 0
+
+    def new_path(self, name):
+        self.runs += 1
+        return os.path.join(self.tmp_dir, f'{self.runs}_{name}')
+
+    def db_copy(self):
+        filepath = self.new_path('costs.sqlite')
+        shutil.copy(self.db_filename, filepath)
+        return DBInterface(filepath)
+
+    def sales_model(self, fill=False):
+        LoftItem.usd_rub_rate = 90
+        model = LoftItemTableModel()
+        model.add_store(self.store.copy())
+        if fill:
+            db = DBInterface(self.db_filename)
+            db.fill_cost_from_db(model)
+            db.close()
+        return model
+
+
+# every case does its setup and returns the part to time
+
+def case_parse(inputs):
+    return lambda: read_sales_from_excel(inputs.report)
+
+
+def case_import(inputs):
+    db = DBInterface(inputs.new_path('empty.sqlite'))
+    return lambda: db.import_costs_to_db(inputs.costs)
+
+
+def case_reimport(inputs):
+    db = inputs.db_copy()
+    costs = changed_costs(inputs.costs)
+    return lambda: db.import_costs_to_db(costs)
+
+
+def case_fill(inputs):
+    db = DBInterface(inputs.db_filename)
+    model = inputs.sales_model()
+    return lambda: db.fill_cost_from_db(model)
+
+
+def case_recalc(inputs):
+    model = inputs.sales_model(fill=True)
+
+    def recalc():
+        LoftItem.usd_rub_rate = 95
+        model.recalculate_cost_rub()
+    return recalc
+
+
+def case_export_xlsx(inputs):
+    store = inputs.sales_model(fill=True).snapshot()
+    filepath = inputs.new_path('sales.xlsx')
+    return lambda: export_rows(filepath, LoftItem.ru_col_names, store.iter_row_batches())
+
+
+def case_export_csv(inputs):
+    store = inputs.sales_model(fill=True).snapshot()
+    filepath = inputs.new_path('sales.csv')
+    return lambda: export_rows(filepath, LoftItem.ru_col_names, store.iter_row_batches())
+
+
+def case_scroll(inputs):
+    app = QApplication.instance()
+    view = QTableView()
+    view.resize(1100, 600)
+    view.setModel(inputs.sales_model(fill=True))
+    view.show()
+    app.processEvents()
+    return lambda: scroll(app, view, 100)
+
+
+cases = {
+    'parse': case_parse,
+    'import': case_import,
+    'reimport': case_reimport,
+    'fill': case_fill,
+    'recalc': case_recalc,
+    'export_xlsx': case_export_xlsx,
+    'export_csv': case_export_csv,
+    'scroll': case_scroll,
+}
+
+
+def run_case(case, inputs, repeat):
+    times = []
+    for _ in range(repeat):
+        timed = case(inputs)
+        started = time.perf_counter()
+        timed()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_FILE):
+        return None
+    with open(BASELINES_FILE, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and compare it with the stored baselines.')
+    parser.add_argument('cases', nargs='*', help=f'default: all of {", ".join(cases)}')
+    parser.add_argument('--rows', type=int, default=50_000, help='rows in the sales report')
+    parser.add_argument('--cost-rows', type=int, default=100_000, help='rows in the cost database')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='slowdown against the baseline that counts as a regression')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = args.cases or list(cases)
+    unknown = [name for name in names if name not in cases]
+    if unknown:
+        print(f'Unknown cases: {", ".join(unknown)}', file=sys.stderr)
+        return 2
+    app = QApplication(sys.argv[:1])
+    baselines = load_baselines()
+    if baselines and (baselines['rows'], baselines['cost_rows']) != (args.rows, args.cost_rows):
+        print(f'baselines are for {baselines["rows"]} rows and {baselines["cost_rows"]} cost rows, not compared')
+        baselines = None
+
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inputs = Inputs(tmp_dir, args.rows, args.cost_rows)
+        for name in names:
+            results[name] = run_case(cases[name], inputs, args.repeat)
+            line = f'{name:12} {results[name]:8.3f}s'
+            baseline = baselines and baselines['results'].get(name)
+            if baseline:
+                ratio = results[name] / baseline
+                line += f'  baseline {baseline:8.3f}s  x{ratio:.2f}'
+                # millisecond cases are all noise, they need to lose 10ms as well
+                if ratio > args.tolerance and results[name] - baseline > 0.01:
+                    regressions.append(name)
+                    line += '  REGRESSION'
+            print(line)
+    app.processEvents()
+
+    if args.save:
+        saved = load_baselines() or {}
+        if (saved.get('rows'), saved.get('cost_rows')) != (args.rows, args.cost_rows):
+            saved = {'rows': args.rows, 'cost_rows': args.cost_rows, 'results': {}}
+        saved['results'].update({name: round(seconds, 4) for name, seconds in results.items()})
+        with open(BASELINES_FILE, 'w', encoding='utf-8') as file:
+            json.dump(saved, file, indent=2)
+            file.write('\n')
+        print(f'baselines saved to {BASELINES_FILE}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
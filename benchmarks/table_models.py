@@ -0,0 +1,94 @@
+# Headless scroll/sort benchmark for the sales and costs table models.
+# Run from the repository root: python -m benchmarks.table_models [rows]
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt6.QtWidgets import QApplication, QTableView
+from PyQt6.QtCore import Qt
+
+from db_interface import DBInterface
+from main import LoftItemTableModel, LoftCostsTableModel
+from benchmarks.generators import make_costs
+
+
+def make_sales_model(rows):
+    rng = np.random.default_rng(0)
+    model = LoftItemTableModel()
+    sold_qty = rng.integers(0, 50, rows)
+    model._data.append(np.array(['A%07d' % i for i in rng.permutation(rows)], dtype=object),
+                       sold_qty,
+                       sold_qty * rng.uniform(100, 5000, rows))
+    return model
+
+
+def make_costs_model(rows, db_filename):
+    db = DBInterface(db_filename)
+    db.import_costs_to_db(make_costs(rows))
+    model = LoftCostsTableModel(db)
+    model.refresh()
+    return model
+
+
+def scroll(app, view, pages):
+    scroll_bar = view.verticalScrollBar()
+    for value in np.linspace(0, scroll_bar.maximum(), pages).astype(int):
+        scroll_bar.setValue(int(value))
+        view.viewport().grab()
+        app.processEvents()
+
+
+def type_filter(app, model, text):
+    # one set_filter per keystroke, as the search box does, returns the slowest keystroke
+    slowest = 0
+    for length in range(1, len(text) + 1):
+        started = time.perf_counter()
+        model.set_filter(text[:length], [('sold_qty', '>', 10)])
+        app.processEvents()
+        slowest = max(slowest, time.perf_counter() - started)
+    model.set_filter('')
+    return slowest
+
+
+def run(app, name, model, pages=200):
+    view = QTableView()
+    view.resize(1100, 600)
+    view.setModel(model)
+    view.show()
+    app.processEvents()
+
+    started = time.perf_counter()
+    scroll(app, view, pages)
+    scroll_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for column in range(model.columnCount(None)):
+        view.sortByColumn(column, Qt.SortOrder.DescendingOrder)
+        view.sortByColumn(column, Qt.SortOrder.AscendingOrder)
+    app.processEvents()
+    sort_time = time.perf_counter() - started
+
+    print(f'{name}: {model.rowCount(None)} rows, scroll {pages} pages {scroll_time:.3f}s, '
+          f'sort all columns both ways {sort_time:.3f}s')
+    if isinstance(model, LoftItemTableModel):
+        # as in MainWindow
+        model.modelReset.connect(view.scrollToTop)
+        print(f'{name}: slowest search keystroke {type_filter(app, model, "A00012") * 1000:.1f}ms')
+    view.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    app = QApplication(sys.argv[:1])
+    run(app, 'sales', make_sales_model(rows))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the costs model pages rows in from SQLite as the view scrolls
+        run(app, 'costs', make_costs_model(rows, os.path.join(tmp_dir, 'costs.sqlite')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Cost price books split over many sheets and files. Every sheet is parsed in its own process,
+# its cost column is validated in one vectorized pass, and what parsed is handed back for a
+# single DBInterface.import_costs_to_db() call. A broken file or a sheet with bad costs is
+# reported in the sheet results instead of aborting the whole import.
+# python cost_sheets.py FILE [FILE ...] [--db test_db.sqlite] [--workers N] [--timings-log FILE]
+import argparse
+import multiprocessing
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
+from xml.etree import ElementTree
+
+import timings
+from db_interface import DBInterface
+
+SHEET_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet'
+
+
+def init_worker(timings_log=None):
+    if timings_log:
+        timings.enable(timings_log)
+
+
+def list_sheets(excel_filepath):
+    # the sheet names come from the workbook part alone, openpyxl would read all shared strings first
+    with zipfile.ZipFile(excel_filepath) as archive:
+        try:
+            workbook = archive.read('xl/workbook.xml')
+        except KeyError:
+            workbook = None
+    if workbook is None:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(excel_filepath, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    return [sheet.get('name') for sheet in ElementTree.fromstring(workbook).iter(SHEET_TAG)]
+
+
+def read_costs_sheet(excel_filepath, sheet_name):
+    # -> (item_codes, costs, invalid_rows). The first row is the header, item codes and costs are
+    # the first two columns. Rows without an item code are skipped, rows whose cost is empty or
+    # not a number are left out and returned as worksheet row numbers.
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    with timings.stage('read costs sheet') as sheet_stage:
+        workbook = load_workbook(excel_filepath, read_only=True, data_only=True)
+        try:
+            values = list(workbook[sheet_name].iter_rows(min_row=2, max_col=2, values_only=True))
+        finally:
+            workbook.close()
+        df = pd.DataFrame.from_records(values, columns=('item_code', 'cost'))
+        df.index += 2
+        df = df[df['item_code'].notna()]
+        costs = pd.to_numeric(df['cost'], errors='coerce')
+        valid = costs.notna().to_numpy()
+        sheet_stage.rows = int(valid.sum())
+        return df['item_code'][valid].tolist(), costs[valid].tolist(), df.index[~valid].tolist()
+
+
+def read_sheet_task(excel_filepath, sheet_name):
+    try:
+        return read_costs_sheet(excel_filepath, sheet_name), None
+    except Exception as error:
+        return ([], [], []), str(error) or type(error).__name__
+
+
+def read_costs_files(filepaths, max_workers=None, timings_log=None, progress=None):
+    # -> (rows, sheets). rows is an iterator of (item_code, cost) in file and sheet order, so a
+    # later sheet overrides an earlier one on import. sheets has one dict per sheet (or per file
+    # that could not be opened) with its row count, invalid row numbers and error.
+    # progress(done, total) is called after every sheet and may raise to cancel the rest.
+    sheets = []
+    for filepath in filepaths:
+        try:
+            names = list_sheets(filepath)
+        except Exception as error:
+            sheets.append({'file': filepath, 'sheet': None, 'rows': 0, 'invalid_rows': [],
+                           'error': str(error) or type(error).__name__})
+            continue
+        sheets += [{'file': filepath, 'sheet': name, 'rows': 0, 'invalid_rows': [], 'error': None}
+                   for name in names]
+    tasks = [sheet for sheet in sheets if sheet['sheet'] is not None]
+    results = [None] * len(tasks)
+
+    def finish(number, result):
+        (item_codes, costs, invalid_rows), error = result
+        results[number] = (item_codes, costs)
+        tasks[number].update(rows=len(item_codes), invalid_rows=invalid_rows, error=error)
+        if progress:
+            progress(sum(done is not None for done in results), len(tasks))
+
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    with timings.stage('read costs files') as read_stage:
+        if workers <= 1:
+            for number, task in enumerate(tasks):
+                finish(number, read_sheet_task(task['file'], task['sheet']))
+        else:
+            # spawned rather than forked, the GUI starts the pool from a worker thread
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_worker, initargs=(timings_log,))
+            try:
+                futures = {pool.submit(read_sheet_task, task['file'], task['sheet']): number
+                           for number, task in enumerate(tasks)}
+                for future in as_completed(futures):
+                    finish(futures[future], future.result())
+            finally:
+                pool.shutdown(cancel_futures=True)
+        read_stage.rows = sum(task['rows'] for task in tasks)
+    return chain.from_iterable(zip(item_codes, costs) for item_codes, costs in results), sheets
+
+
+def shown_rows(invalid_rows, limit=5):
+    shown = ', '.join(str(row) for row in invalid_rows[:limit])
+    if len(invalid_rows) > limit:
+        shown += ', ...'
+    return shown
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Import costs from every sheet of the given Excel files.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--db', default='test_db.sqlite')
+    parser.add_argument('--workers', type=int, help='number of processes (default: CPU count)')
+    parser.add_argument('--timings-log', help='append per-stage timings of every process to this JSON lines file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.timings_log:
+        timings.enable(args.timings_log)
+    rows, sheets = read_costs_files(args.files, args.workers, args.timings_log)
+    db = DBInterface(args.db)
+    import_result = db.import_costs_to_db(rows)
+    db.close()
+    for sheet in sheets:
+        place = sheet['file'] if sheet['sheet'] is None else f'{sheet["file"]} [{sheet["sheet"]}]'
+        if sheet['error']:
+            print(f'{place}: error: {sheet["error"]}', file=sys.stderr)
+        elif sheet['invalid_rows']:
+            print(f'{place}: {len(sheet["invalid_rows"])} rows without a numeric cost, '
+                  f'skipped (rows {shown_rows(sheet["invalid_rows"])})', file=sys.stderr)
+    print('{inserted} inserted, {updated} updated, {unchanged} unchanged, '
+          '{history_only} only in history'.format(**import_result))
+    return 1 if any(sheet['error'] or sheet['invalid_rows'] for sheet in sheets) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,386 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date
+from os import path
+
+import timings
+from exporters import export_rows
+
+# PRAGMA user_version of a database with every table below, older files are migrated on open
+SCHEMA_VERSION = 3
+# effective date given to the costs and rate that existed before history was kept
+HISTORY_START_DATE = '1970-01-01'
+
+
+def split_list(input_list, chunk_size):
+    out_list = []
+    for i in range(0, len(input_list), chunk_size):
+        out_list.append(input_list[i:i + chunk_size])
+
+    return out_list
+
+
+def iso_date(value=None):
+    if value is None:
+        return date.today().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class DBInterface:
+    def __init__(self, db_filename):
+        self.db_filename = db_filename
+        # one long-lived connection per thread: background readers never share the UI thread's connection
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        if not path.isfile(self.db_filename):
+            self.create_db()
+        else:
+            self.migrate_db()
+
+    @property
+    def db_con(self):
+        return getattr(self._local, 'db_con', None)
+
+    @property
+    def db_cursor(self):
+        return getattr(self._local, 'db_cursor', None)
+
+    def using_db_connection(func):
+        def handle_connection(self, *args, **kwargs):
+            self.open_connection()
+            return func(self, *args, **kwargs)
+
+        return handle_connection
+
+    def open_connection(self):
+        if self.db_con is None:
+            db_con = sqlite3.connect(self.db_filename, timeout=30, cached_statements=256, check_same_thread=False)
+            # WAL lets readers in worker threads run while the UI thread writes
+            db_con.execute("PRAGMA journal_mode = WAL")
+            db_con.execute("PRAGMA synchronous = NORMAL")
+            db_con.execute("PRAGMA temp_store = MEMORY")
+            db_con.execute("PRAGMA cache_size = -65536")
+            self._local.db_con = db_con
+            self._local.db_cursor = db_con.cursor()
+            with self._connections_lock:
+                self._connections.append(db_con)
+
+    def close_connection(self):
+        # closes the connection of the calling thread only
+        db_con = self.db_con
+        if db_con is not None:
+            with self._connections_lock:
+                self._connections.remove(db_con)
+            db_con.close()
+            self._local.db_con = None
+            self._local.db_cursor = None
+
+    def close(self):
+        with self._connections_lock:
+            for db_con in self._connections:
+                db_con.close()
+            self._connections = []
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        self.open_connection()
+        if self.db_con.in_transaction:
+            # nested use joins the outer transaction
+            yield self.db_cursor
+            return
+        self.db_cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db_cursor
+        except BaseException:
+            self.db_con.rollback()
+            raise
+        self.db_con.commit()
+
+    def create_db(self):
+        with self.transaction():
+            self.db_cursor.execute("CREATE TABLE items_cost(item_code TEXT PRIMARY KEY NOT NULL UNIQUE, cost FLOAT)")
+            self.db_cursor.execute('CREATE UNIQUE INDEX "item_code" ON "items_cost"("item_code" ASC)')
+            self.db_cursor.execute("CREATE TABLE settings(param, value)")
+            self.db_cursor.execute('CREATE UNIQUE INDEX "param" ON "settings"("param" ASC)')
+            self.db_cursor.execute("INSERT INTO settings (param, value) VALUES ('usd_exchange_rate', 0)")
+            self.create_history_tables()
+            self.create_cost_index()
+            self.create_code_search_index()
+            self.db_cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def migrate_db(self):
+        self.open_connection()
+        version = self.db_cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self.transaction():
+            if version < 1:
+                # cost and exchange rate history, seeded with the current values
+                self.create_history_tables()
+                self.db_cursor.execute("""INSERT OR IGNORE INTO items_cost_history(item_code, effective_date, cost)
+                                          SELECT item_code, :start_date, cost FROM items_cost""",
+                                       {'start_date': HISTORY_START_DATE})
+                self.db_cursor.execute("""INSERT OR IGNORE INTO usd_exchange_rate_history(effective_date, rate)
+                                          SELECT :start_date, value FROM settings WHERE param = 'usd_exchange_rate'""",
+                                       {'start_date': HISTORY_START_DATE})
+            if version < 2:
+                self.create_cost_index()
+            if version < 3:
+                self.create_code_search_index()
+            self.db_cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def create_cost_index(self):
+        # lets the costs page sort and page by cost without scanning the table
+        self.db_cursor.execute('CREATE INDEX IF NOT EXISTS "items_cost_cost" ON "items_cost"("cost", "item_code")')
+
+    def create_code_search_index(self):
+        # case-insensitive item code prefix search on the costs page, like the sales page's search
+        self.db_cursor.execute('CREATE INDEX IF NOT EXISTS "items_cost_code_nocase" '
+                               'ON "items_cost"("item_code" COLLATE NOCASE)')
+
+    def create_history_tables(self):
+        # WITHOUT ROWID tables are stored in their primary key b-tree, so (item_code, effective_date)
+        # lookups are covering and as-of queries never touch a second structure
+        self.db_cursor.execute("""CREATE TABLE IF NOT EXISTS items_cost_history(
+                                      item_code TEXT NOT NULL,
+                                      effective_date TEXT NOT NULL,
+                                      cost FLOAT,
+                                      PRIMARY KEY (item_code, effective_date)) WITHOUT ROWID""")
+        self.db_cursor.execute("""CREATE TABLE IF NOT EXISTS usd_exchange_rate_history(
+                                      effective_date TEXT PRIMARY KEY NOT NULL,
+                                      rate FLOAT) WITHOUT ROWID""")
+
+    def import_costs_to_db(self, list_of_items, batch_size=10000, effective_date=None):
+        # The sheet is first compared with the stored costs in memory (a hash join of (item_code, cost)
+        # pairs), so only new and changed rows are streamed into a temp staging table and merged into
+        # items_cost with a single upsert, all inside one transaction. Costs that differ from the ones
+        # in effect on effective_date (today by default) are also recorded in items_cost_history.
+        # 'changed' in the result lists the (item_code, cost) rows written to items_cost.
+        effective_date = iso_date(effective_date)
+        with timings.stage('import costs to db') as import_stage, self.transaction():
+            # the last occurrence of a code in the sheet wins, as with the row-by-row upsert. Codes are
+            # keyed as the TEXT column stores them (numeric cells come as 100000 or 12345.0), so
+            # they compare equal to the stored ones. NaN costs are stored as NULL and never equal
+            # themselves, so they are made None here.
+            incoming = {str(item[0]): None if item[1] != item[1] else item[1] for item in list_of_items}
+            import_stage.rows = len(incoming)
+            newer_history = self.db_cursor.execute("SELECT 1 FROM items_cost_history WHERE effective_date > ? LIMIT 1",
+                                                   (effective_date,)).fetchone()
+            if newer_history is None:
+                # nothing is dated after this import, so items_cost holds the costs in effect and rows
+                # equal to it change nothing. Back-dated imports compare against the history instead.
+                with timings.stage('compare costs'):
+                    current = dict(self.db_cursor.execute("SELECT item_code, cost FROM items_cost"))
+                    if current:
+                        to_stage = list(incoming.items() - current.items())
+                    else:
+                        to_stage = list(incoming.items())
+                    del current
+            else:
+                to_stage = list(incoming.items())
+            skipped = len(incoming) - len(to_stage)
+
+            self.db_cursor.execute("CREATE TEMP TABLE IF NOT EXISTS costs_import"
+                                   "(item_code TEXT PRIMARY KEY NOT NULL, cost FLOAT) WITHOUT ROWID")
+            self.db_cursor.execute("DELETE FROM costs_import")
+            with timings.stage('stage costs', len(to_stage)):
+                for start in range(0, len(to_stage), batch_size):
+                    self.db_cursor.executemany("INSERT OR REPLACE INTO costs_import(item_code, cost) VALUES (?, ?)",
+                                               to_stage[start:start + batch_size])
+
+            # a cost differing from the one in effect on effective_date is recorded in the history
+            not_in_effect = """cost IS NOT (SELECT history.cost FROM items_cost_history AS history
+                                             WHERE history.item_code = costs_import.item_code
+                                             AND history.effective_date <= :effective_date
+                                             ORDER BY history.effective_date DESC LIMIT 1)"""
+            newer_cost = """EXISTS (SELECT 1 FROM items_cost_history AS history
+                                    WHERE history.item_code = costs_import.item_code
+                                    AND history.effective_date > :effective_date)"""
+            params = {'effective_date': effective_date}
+            blocked = history_only = 0
+            if newer_history is not None:
+                blocked, history_only = self.db_cursor.execute(
+                    f"""SELECT COUNT(*), COUNT(CASE WHEN {not_in_effect} THEN 1 END)
+                        FROM costs_import WHERE {newer_cost}""", params).fetchone()
+            self.db_cursor.execute(f"""INSERT INTO items_cost_history(item_code, effective_date, cost)
+                                       SELECT item_code, :effective_date, cost FROM costs_import WHERE {not_in_effect}
+                                       ON CONFLICT (item_code, effective_date) DO UPDATE SET cost = excluded.cost""",
+                                   params)
+
+            # items_cost keeps the latest cost: a code with a newer cost in the history only gets the
+            # history row above, and is left out of items_cost and of the counts below
+            if blocked:
+                self.db_cursor.execute(f"DELETE FROM costs_import WHERE {newer_cost}", params)
+            total = self.db_cursor.execute("SELECT COUNT(*) FROM costs_import").fetchone()[0]
+            existing, updated = self.db_cursor.execute(
+                """SELECT COUNT(*), COUNT(CASE WHEN items_cost.cost IS NOT costs_import.cost THEN 1 END)
+                   FROM costs_import JOIN items_cost USING (item_code)""").fetchone()
+            if newer_history is None:
+                changed = to_stage
+            else:
+                changed = self.db_cursor.execute(
+                    """SELECT costs_import.item_code, costs_import.cost FROM costs_import
+                       LEFT JOIN items_cost USING (item_code)
+                       WHERE items_cost.item_code IS NULL OR items_cost.cost IS NOT costs_import.cost""").fetchall()
+            # WHERE true keeps SQLite from parsing ON CONFLICT as the join constraint of the SELECT
+            self.db_cursor.execute("""INSERT INTO items_cost(item_code, cost)
+                                      SELECT item_code, cost FROM costs_import WHERE true
+                                      ON CONFLICT (item_code) DO UPDATE SET cost = excluded.cost
+                                      WHERE items_cost.cost IS NOT excluded.cost""")
+            self.db_cursor.execute("DROP TABLE costs_import")
+
+        # history_only: back-dated costs recorded in the history while a newer cost stays in effect
+        return {'inserted': total - existing, 'updated': updated,
+                'unchanged': existing - updated + skipped + blocked - history_only,
+                'history_only': history_only, 'changed': changed}
+
+    @using_db_connection
+    def get_costs_from_db(self):
+        res = self.db_cursor.execute("SELECT item_code, cost FROM items_cost ORDER BY item_code ASC")
+        items_costs_list = res.fetchall()
+        return items_costs_list
+
+    @using_db_connection
+    def get_costs_page(self, order_by='item_code', descending=False, prefix='', after=None, limit=1000):
+        # Keyset pagination: `after` is the (order_by value, item_code) of the last row already
+        # shown, so every page is an index seek regardless of how deep the view has scrolled.
+        # `prefix` filters item codes case-insensitively with a range on the NOCASE index (NOCASE
+        # folds ASCII letters only), a prefix without letters uses the primary key.
+        if order_by not in ('item_code', 'cost'):
+            raise ValueError(f'Unknown costs order: {order_by}')
+        direction = 'DESC' if descending else 'ASC'
+        compare = '<' if descending else '>'
+        conditions = []
+        params = {'limit': limit}
+        if prefix:
+            collate = ' COLLATE NOCASE' if prefix.lower() != prefix.upper() else ''
+            conditions.append(f"item_code >= :prefix{collate} AND item_code < :prefix_end{collate}")
+            params['prefix'] = prefix
+            params['prefix_end'] = prefix + '\U0010ffff'
+
+        if order_by == 'item_code':
+            order = f"item_code {direction}"
+            if after is not None:
+                conditions.append(f"item_code {compare} :after_code")
+                params['after_code'] = after[1]
+        else:
+            # NULL costs sort first ascending and last descending
+            order = f"cost {direction}, item_code {direction}"
+            if after is not None:
+                params['after_cost'], params['after_code'] = after
+                if after[0] is None and descending:
+                    conditions.append("cost IS NULL AND item_code < :after_code")
+                elif after[0] is None:
+                    conditions.append("(cost IS NULL AND item_code > :after_code) OR cost IS NOT NULL")
+                elif descending:
+                    conditions.append("(cost, item_code) < (:after_cost, :after_code) OR cost IS NULL")
+                else:
+                    conditions.append("(cost, item_code) > (:after_cost, :after_code)")
+
+        where = ('WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)) if conditions else ''
+        res = self.db_cursor.execute(f"SELECT item_code, cost FROM items_cost {where} ORDER BY {order} LIMIT :limit",
+                                     params)
+        return res.fetchall()
+
+    def iter_costs(self, batch_size=10000):
+        # own cursor, so other calls on this thread's connection don't reset the iteration
+        self.open_connection()
+        cursor = self.db_con.cursor()
+        try:
+            cursor.execute("SELECT item_code, cost FROM items_cost ORDER BY item_code ASC")
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+    def export_costs_to_file(self, filepath, column_labels=("Артикул", "Цена")):
+        with timings.stage('export costs'):
+            export_rows(filepath, list(column_labels), self.iter_costs(), [str, float])
+
+    def export_costs_to_excel(self, excel_filepath):
+        self.export_costs_to_file(excel_filepath)
+
+    @using_db_connection
+    def get_costs_for_items(self, item_codes_list):
+        items_costs = []
+        # stay below the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite builds
+        for chunk in split_list(item_codes_list, 900):
+            res = self.db_cursor.execute('SELECT item_code, cost FROM items_cost WHERE item_code IN (%s)' %
+                                         ', '.join('?' * len(chunk)),
+                                         chunk)
+            items_costs.extend(res.fetchall())
+        return items_costs
+
+    @using_db_connection
+    def get_costs_as_of(self, as_of_date, item_codes_list=None):
+        # one statement for any number of codes: the codes go to a temp table and each one is
+        # resolved with a single seek into the (item_code, effective_date) key
+        params = {'as_of_date': iso_date(as_of_date)}
+        if item_codes_list is None:
+            res = self.db_cursor.execute("""SELECT item_code, cost, MAX(effective_date) FROM items_cost_history
+                                            WHERE effective_date <= :as_of_date
+                                            GROUP BY item_code""", params)
+            return [item[:2] for item in res.fetchall() if item[1] is not None]
+
+        self.db_cursor.execute("CREATE TEMP TABLE IF NOT EXISTS codes_lookup(item_code TEXT PRIMARY KEY NOT NULL)"
+                               " WITHOUT ROWID")
+        self.db_cursor.execute("DELETE FROM codes_lookup")
+        self.db_cursor.executemany("INSERT OR IGNORE INTO codes_lookup(item_code) VALUES (?)",
+                                   ((item_code,) for item_code in item_codes_list))
+        res = self.db_cursor.execute("""SELECT item_code, cost FROM (
+                                            SELECT item_code,
+                                                   (SELECT history.cost FROM items_cost_history AS history
+                                                    WHERE history.item_code = codes_lookup.item_code
+                                                    AND history.effective_date <= :as_of_date
+                                                    ORDER BY history.effective_date DESC LIMIT 1) AS cost
+                                            FROM codes_lookup)
+                                        WHERE cost IS NOT NULL""", params)
+        items_costs = res.fetchall()
+        self.db_cursor.execute("DROP TABLE codes_lookup")
+        # the temp table writes opened an implicit transaction
+        self.db_con.commit()
+        return items_costs
+
+    def fill_cost_from_db(self, loft_items_list, as_of_date=None):
+        with timings.stage('fill costs from db') as fill_stage:
+            item_codes_list = loft_items_list.get_item_codes()
+            with timings.stage('select costs') as select_stage:
+                if as_of_date is None:
+                    items_costs = self.get_costs_for_items(item_codes_list)
+                else:
+                    items_costs = self.get_costs_as_of(as_of_date, item_codes_list)
+                select_stage.rows = len(items_costs)
+            fill_stage.rows = len(item_codes_list)
+            return loft_items_list.apply_costs(items_costs)
+
+    @using_db_connection
+    def get_usd_exchange_rate(self, as_of_date=None):
+        if as_of_date is not None:
+            res = self.db_cursor.execute("""SELECT rate FROM usd_exchange_rate_history WHERE effective_date <= ?
+                                            ORDER BY effective_date DESC LIMIT 1""", (iso_date(as_of_date),))
+            row = res.fetchone()
+            return row[0] if row else 0
+        res = self.db_cursor.execute("SELECT value FROM settings WHERE param = 'usd_exchange_rate'")
+        return res.fetchone()[0]
+
+    def set_usd_exchange_rate(self, usd_exchange_rate, effective_date=None):
+        with self.transaction():
+            effective_date = iso_date(effective_date)
+            # settings keep the latest rate, a back-dated rate only goes into the history
+            self.db_cursor.execute("""UPDATE settings SET value = :usd_exchange_rate
+                                      WHERE param = 'usd_exchange_rate'
+                                      AND NOT EXISTS (SELECT 1 FROM usd_exchange_rate_history
+                                                      WHERE effective_date > :effective_date)""",
+                                   {'usd_exchange_rate': usd_exchange_rate, 'effective_date': effective_date})
+            self.db_cursor.execute("""INSERT INTO usd_exchange_rate_history(effective_date, rate)
+                                      VALUES (:effective_date, :usd_exchange_rate)
+                                      ON CONFLICT (effective_date) DO UPDATE SET rate = excluded.rate""",
+                                   {'effective_date': effective_date, 'usd_exchange_rate': usd_exchange_rate})
@@ -0,0 +1,74 @@
+import csv
+from os import path
+
+# Exports take the column labels and an iterable of row batches (lists of row sequences), so rows
+# can be streamed from a SalesStore or a SQLite cursor without building a whole table in memory.
+# column_types (str, int or float per column) fix the Parquet schema before the first batch; without
+# them the first column is the item code as text and every other column is a float.
+export_formats = ['.xlsx', '.csv', '.parquet']
+
+
+def export_format(filepath):
+    extension = path.splitext(filepath)[1].lower()
+    if extension not in export_formats:
+        raise ValueError(f'Unsupported export format: {extension}')
+    return extension
+
+
+def export_rows(filepath, column_labels, row_batches, column_types=None):
+    extension = export_format(filepath)
+    if extension == '.csv':
+        export_rows_to_csv(filepath, column_labels, row_batches)
+    elif extension == '.parquet':
+        export_rows_to_parquet(filepath, column_labels, row_batches, column_types)
+    else:
+        export_sheets_to_xlsx(filepath, [('Sheet1', column_labels, row_batches)])
+
+
+def export_sheets_to_xlsx(filepath, sheets):
+    from openpyxl import Workbook
+
+    # write_only workbooks keep only the row being written in memory
+    workbook = Workbook(write_only=True)
+    for sheet_name, column_labels, row_batches in sheets:
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append(column_labels)
+        for batch in row_batches:
+            for row in batch:
+                sheet.append(row)
+    workbook.save(filepath)
+
+
+def export_rows_to_csv(filepath, column_labels, row_batches):
+    # utf-8-sig so Excel opens the cyrillic headers correctly
+    with open(filepath, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(column_labels)
+        for batch in row_batches:
+            writer.writerows(batch)
+
+
+def export_rows_to_parquet(filepath, column_labels, row_batches, column_types=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if column_types is None:
+        column_types = [str] + [float] * (len(column_labels) - 1)
+    arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+    # the schema is set up front, a first batch of all-int or all-NULL values can't decide it for the file
+    schema = pa.schema([(label, arrow_types[column_type]) for label, column_type in zip(column_labels, column_types)])
+    with pq.ParquetWriter(filepath, schema) as writer:
+        for batch in row_batches:
+            if not len(batch):
+                continue
+            writer.write_table(pa.Table.from_arrays(
+                [_arrow_array(pa, column, column_type, field.type)
+                 for column, column_type, field in zip(zip(*batch), column_types, schema)],
+                schema=schema))
+
+
+def _arrow_array(pa, values, column_type, arrow_type):
+    if column_type is str:
+        # numeric item codes are written as text, like SQLite stores them
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
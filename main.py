@@ -1,111 +1,95 @@
-import pandas as pd
-import sqlite3
-from os import path
+import numpy as np
 
+import argparse
+import os
 import sys
+from os import path
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QPushButton,
     QMessageBox, QTabWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QInputDialog, QFileDialog, QTableView,
+    QLabel, QInputDialog, QFileDialog, QTableView, QLineEdit, QComboBox,
 )
-from PyQt6.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel
-
-
-def split_list(input_list, chunk_size):
-    out_list = []
-    for i in range(0, len(input_list), chunk_size):
-        out_list.append(input_list[i:i + chunk_size])
-
-    return out_list
-
-
-class DBInterface:
-    def __init__(self, db_filename):
-        self.db_con = None
-        self.db_cursor = None
-        self.db_filename = db_filename
-        if not path.isfile(self.db_filename):
-            self.create_db()
-
-    def using_db_connection(func):
-        def handle_connection(self, *args, **kwargs):
-            try:
-                self.open_connection()
-                return func(self, *args, **kwargs)
-            finally:
-                self.close_connection()
-
-        return handle_connection
-
-    def open_connection(self):
-        if not self.db_con:
-            self.db_con = sqlite3.connect(self.db_filename)
-        if not self.db_cursor:
-            self.db_cursor = self.db_con.cursor()
-
-    def close_connection(self):
-        if self.db_con:
-            self.db_con.close()
-            self.db_con = None
-            self.db_cursor = None
-
-    @using_db_connection
-    def create_db(self):
-        self.db_cursor.execute("CREATE TABLE items_cost(item_code TEXT PRIMARY KEY NOT NULL UNIQUE, cost FLOAT)")
-        self.db_cursor.execute('CREATE UNIQUE INDEX "item_code" ON "items_cost"("item_code" ASC)')
-        self.db_cursor.execute("CREATE TABLE settings(param, value)")
-        self.db_cursor.execute('CREATE UNIQUE INDEX "param" ON "settings"("param" ASC)')
-        self.db_cursor.execute("INSERT INTO settings (param, value) VALUES ('usd_exchange_rate', 0)")
-        self.db_con.commit()
-
-    @using_db_connection
-    def import_costs_to_db(self, list_of_items):
-        for item in list_of_items:
-            self.db_cursor.execute("""INSERT INTO items_cost(item_code, cost) VALUES (:item_code, :cost)
-                                            ON CONFLICT (item_code) DO UPDATE SET cost = :cost""",
-                                   {'item_code': item[0],
-                                    'cost': item[1]})
-        self.db_con.commit()
-
-    @using_db_connection
-    def get_costs_from_db(self):
-        res = self.db_cursor.execute("SELECT item_code, cost FROM items_cost ORDER BY item_code ASC")
-        items_costs_list = res.fetchall()
-        return items_costs_list
-
-    def export_costs_to_excel(self, excel_filepath):
-        data_list = self.get_costs_from_db()
-        df = pd.DataFrame(data_list, columns=["Артикул", "Цена"])
-        df.to_excel(excel_filepath, index=False)
-
-    @using_db_connection
-    def fill_cost_from_db(self, loft_items_list):
-        item_codes_list = loft_items_list.get_item_codes()
-        for chunk in split_list(item_codes_list, 100):
-            res = self.db_cursor.execute('SELECT item_code, cost FROM items_cost WHERE item_code IN (%s)' %
-                                         ', '.join('?' * len(chunk)),
-                                         chunk)
-            for item in res.fetchall():
-                loft_items_list.update_item_cost(item[0], item[1])
-
-    @using_db_connection
-    def get_usd_exchange_rate(self):
-        res = self.db_cursor.execute("SELECT value FROM settings WHERE param = 'usd_exchange_rate'")
-        return res.fetchone()[0]
-
-    @using_db_connection
-    def set_usd_exchange_rate(self, usd_exchange_rate):
-        self.db_cursor.execute("UPDATE settings SET value = :usd_exchange_rate WHERE param = 'usd_exchange_rate'",
-                               {'usd_exchange_rate': usd_exchange_rate})
-        self.db_con.commit()
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, pyqtSignal
+
+import timings
+from cost_sheets import read_costs_files, shown_rows
+from db_interface import DBInterface
+from exporters import export_rows
+from report_cache import ReportCache
+from sales_store import SalesStore, aggregate_sales, read_sales_from_excel
+
+# rows measured by resizeColumnsToContents besides the visible ones (Qt's default is 1000)
+RESIZE_SAMPLE_ROWS = 100
+
+
+def remap_persistent_indexes(model, order):
+    # order[new_row] == old_row, as returned by argsort
+    old_indexes = model.persistentIndexList()
+    if not old_indexes:
+        return
+    new_rows = np.empty(len(order), dtype=np.int64)
+    new_rows[order] = np.arange(len(order))
+    new_indexes = [model.index(int(new_rows[index.row()]), index.column()) for index in old_indexes]
+    model.changePersistentIndexList(old_indexes, new_indexes)
+
+
+class WorkerCancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    done = pyqtSignal()
+
+
+class Worker(QRunnable):
+    # Runs func(worker, *args) on the thread pool. func reports its stages through
+    # worker.report_progress(), which is also where a pending cancellation is raised.
+    # cleanup runs on the same thread once func is done, however it ended.
+    def __init__(self, func, *args, cleanup=None):
+        super(Worker, self).__init__()
+        self.func = func
+        self.args = args
+        self.cleanup = cleanup
+        self.signals = WorkerSignals()
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def report_progress(self, message):
+        if self.is_cancelled:
+            raise WorkerCancelled
+        self.signals.progress.emit(message)
+
+    def run(self):
+        try:
+            result = self.func(self, *self.args)
+            if self.is_cancelled:
+                raise WorkerCancelled
+        except WorkerCancelled:
+            self.signals.cancelled.emit()
+        except Exception as error:
+            self.signals.failed.emit(error)
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            if self.cleanup is not None:
+                self.cleanup()
+            self.signals.done.emit()
 
 
 class LoftItem:
+    # Tables are kept in a SalesStore, LoftItem stays for single rows passed around by hand.
+    # Slotted, so an item has no per-instance __dict__ (about 30% less memory per object).
+    __slots__ = ('item_code', 'sold_qty', 'sold_price', 'sold_sum', 'cost_rub', 'cost_usd', 'margin_rub', 'margin_pct')
     usd_rub_rate = 0
-    col_names = ['item_code', 'sold_qty', 'sold_price', 'sold_sum',
-                 'cost_rub', 'cost_usd', 'margin_rub', 'margin_pct']
-    ru_col_names = ['Артикул', 'Количество продано', 'Средняя цена продажи', 'Сумма продано',
-                    'Себестоимость РУБ', 'Себестоимость USD', 'Маржинальность РУБ/шт', 'Маржинальность %' ]
+    col_names = SalesStore.col_names
+    ru_col_names = SalesStore.ru_col_names
+    col_types = SalesStore.col_types
 
     def __init__(self, item_code, sold_qty, sold_sum):
         self.cost_usd = 0
@@ -119,10 +103,9 @@ class LoftItem:
         self.sold_sum = sold_sum
         self.margin_rub = 0
         self.margin_pct = 0
-        self.image = None
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.get_properties_dict())
 
     def set_cost_usd(self, cost_usd):
         if cost_usd > 0:
@@ -171,14 +154,20 @@ class LoftItem:
 class LoftItemTableModel(QAbstractTableModel):
     def __init__(self, *args, data=None, **kwargs):
         super(LoftItemTableModel, self).__init__()
-        self._data = data or []
+        self._data = SalesStore()
+        self._sort_order = None
+        # store rows shown by the view in display order, None while no filter is set
+        self._visible = None
+        self._filter = ('', ())
         self.col_names = LoftItem.col_names
         self.ru_col_names = LoftItem.ru_col_names
+        for item in data or []:
+            self.add_item(item)
 
     def __repr__(self):
         out_str = ""
-        for item in self._data:
-            out_str += str(item) + '\n'
+        for row in range(len(self._data)):
+            out_str += str(dict(zip(self.col_names, self._data.get_row(row)))) + '\n'
         return out_str
 
     def __len__(self):
@@ -186,35 +175,16 @@ class LoftItemTableModel(QAbstractTableModel):
 
     def data(self, index, role):
         if role == Qt.ItemDataRole.DisplayRole:
-            # See below for the nested-list data structure.
-            # .row() indexes into the outer list,
-            # .column() indexes into the sub-list
-            value = self._data[index.row()].get_properties_dict()[self.col_names[index.column()]]
-
-            # if isinstance(value, datetime):
-            # Render time to YYY-MM-DD.
-            #    return value.strftime("%Y-%m-%d")
+            # cells are read straight from the column arrays of the sales store
+            row = index.row() if self._visible is None else self._visible[index.row()]
+            return self._data.value(row, index.column())
 
-            # if isinstance(value, int):
-            #    return str(value)
-
-            # if isinstance(value, float):
-            # Render float to 2 dp
-            #    return "%.2f" % value
-
-            # if isinstance(value, str):
-            # Render strings with quotes
-            #    return '"%s"' % value
-
-            # Default (anything not captured above: e.g. int)
-            return value
     def rowCount(self, index):
-        # The length of the outer list.
-        return len(self._data)
+        if self._visible is None:
+            return len(self._data)
+        return len(self._visible)
 
     def columnCount(self, index):
-        # The following takes the first sub-list, and returns
-        # the length (only works if all rows are an equal length)
         return len(self.col_names)
 
     def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
@@ -222,97 +192,155 @@ class LoftItemTableModel(QAbstractTableModel):
             return self.ru_col_names[section]
         return QAbstractTableModel.headerData(self, section, orientation, role)
 
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        with timings.stage('sort sales', len(self._data)):
+            self._sort_order = (column, order)
+            self.layoutAboutToBeChanged.emit()
+            rows_order = self._data.sort(self.col_names[column], order == Qt.SortOrder.DescendingOrder)
+            if self._visible is not None:
+                # the filtered rows stay the same, only their store rows and display order change
+                new_rows = np.empty(len(rows_order), dtype=np.int64)
+                new_rows[rows_order] = np.arange(len(rows_order))
+                moved_rows = new_rows[self._visible]
+                rows_order = np.argsort(moved_rows, kind='stable')
+                self._visible = moved_rows[rows_order]
+            remap_persistent_indexes(self, rows_order)
+            self.layoutChanged.emit()
+
+    def set_filter(self, prefix='', conditions=()):
+        # prefix matches the start of item codes, conditions are (col_name, operator, value)
+        with timings.stage('filter sales') as filter_stage:
+            self._filter = (prefix.strip(), tuple(conditions))
+            self.beginResetModel()
+            self._apply_filter()
+            self.endResetModel()
+            filter_stage.rows = self.rowCount(None)
+
+    def _apply_filter(self):
+        prefix, conditions = self._filter
+        if prefix or conditions:
+            self._visible = self._data.filter_rows(prefix, conditions)
+        else:
+            self._visible = None
+
+    def _rows_changed(self, rows, first_column, last_column):
+        # rows are store rows, a numeric filter has to be re-evaluated after values change
+        if self._filter[1]:
+            self.set_filter(*self._filter)
+            return
+        if self._visible is not None:
+            rows = np.searchsorted(self._visible, rows)
+            rows = rows[rows < len(self._visible)]
+        if not len(rows):
+            return
+        self.dataChanged.emit(self.index(int(rows.min()), self.col_names.index(first_column)),
+                              self.index(int(rows.max()), self.col_names.index(last_column)),
+                              [Qt.ItemDataRole.DisplayRole])
+
     def add_item(self, loft_item):
         if not isinstance(loft_item, LoftItem):
             return TypeError
-        self._data.append(loft_item)
+        self._data.append([loft_item.item_code], [loft_item.sold_qty], [loft_item.sold_sum])
+        self._apply_filter()
 
     def recalculate_cost_rub(self):
-        for item in self._data:
-            item.calculate_cost_rub()
+        # a rate change only touches cost_rub and the margins, cost_usd is already in the store
+        with timings.stage('recalculate margins', len(self._data)):
+            self._data.recalculate(LoftItem.usd_rub_rate)
+            if self._filter[1]:
+                self.set_filter(*self._filter)
+                return
+            last_row = self.rowCount(None) - 1
+            if last_row < 0:
+                return
+            for first_column, last_column in (('cost_rub', 'cost_rub'), ('margin_rub', 'margin_pct')):
+                self.dataChanged.emit(self.index(0, self.col_names.index(first_column)),
+                                      self.index(last_row, self.col_names.index(last_column)),
+                                      [Qt.ItemDataRole.DisplayRole])
 
     def get_item_codes(self):
-        return list(item.item_code for item in self._data)
+        return self._data['item_code'].tolist()
 
     def get_items_list(self):
-        out = [row.get_properties_list() for row in self._data]
-        return out
+        return self._data.get_rows()
 
     def update_item_cost(self, item_code, new_cost):
-        for item in self._data:
-            if item.item_code == item_code:
-                item.cost_usd = new_cost
-                item.calculate_cost_rub()
-                return True
-        return None
+        row = self._data.find_row(item_code)
+        if row is None:
+            return None
+        self._data.set_cost_usd([row], new_cost)
+        self._data.recalculate(LoftItem.usd_rub_rate, [row])
+        self._rows_changed(np.array([row]), 'cost_rub', 'margin_pct')
+        return True
+
+    def apply_costs(self, items_costs):
+        with timings.stage('apply costs', len(items_costs)):
+            rows = self._data.apply_costs(items_costs, LoftItem.usd_rub_rate)
+            if not len(rows):
+                return 0
+
+            # one signal covering the cost and margin columns of all touched rows
+            self._rows_changed(np.sort(rows), 'cost_rub', 'margin_pct')
+            return len(rows)
+
+    def add_store(self, sales_store):
+        # another report is merged in by item_code rather than appended, and swapped in with a single
+        # model reset, so views never see a half-merged table
+        with timings.stage('merge sales') as merge_stage:
+            merged_store = aggregate_sales([self._data, sales_store], usd_rub_rate=LoftItem.usd_rub_rate)
+            self.beginResetModel()
+            self._data = merged_store
+            if self._sort_order is not None:
+                column, order = self._sort_order
+                self._data.sort(self.col_names[column], order == Qt.SortOrder.DescendingOrder)
+            self._apply_filter()
+            self.endResetModel()
+            merge_stage.rows = len(self._data)
 
     def read_sales_from_excel(self, excel_filepath):
-        df = pd.read_excel(excel_filepath)
-
-        start_trigger_value = "Номенклатура"
-        countdown_trigger = False
-
-        for item in df.iloc:
-            if item[0] == start_trigger_value:
-                countdown_trigger = True
-                continue
-            if countdown_trigger and (not pd.isna(item[0])):
-                df.drop(range(0, item.name), axis=0, inplace=True)
-                break
-
-        for item in df.tail(10).iloc:
-            if item[0] == 'Итого':
-                df.drop(item.name, axis=0, inplace=True)
-
-        df.dropna(axis=0, inplace=True, how="all")
-        df.dropna(axis=1, inplace=True, how="all")
-        df.reset_index(drop=True, inplace=True)
-        df.fillna(0, inplace=True)
-        df.sort_values(df.columns[0], axis=0, inplace=True)
-
-        output_fields_arr = [1, 2, 3]
+        self.add_store(read_sales_from_excel(excel_filepath))
 
-        for item in df.iloc:
-            art = item[output_fields_arr[0]]
-            sold = int(item[output_fields_arr[1]])
-            sum_rub = float(item[output_fields_arr[2]])
-
-            self.add_item(LoftItem(art, sold, sum_rub))
+    def snapshot(self):
+        return self._data.copy()
 
     def save_sales_to_excel(self, excel_filepath):
-        df = pd.DataFrame(self.get_items_list(), columns=self.ru_col_names)
         try:
-            df.to_excel(excel_filepath, index=False)
+            export_rows(excel_filepath, self.ru_col_names, self._data.iter_row_batches(), SalesStore.col_types)
             return 0
         except:
             return 'Ошибка при сохранении файла'
 
 
 class LoftCostsTableModel(QAbstractTableModel):
-    def __init__(self, *args, data=None, **kwargs):
+    # Rows are paged in from SQLite as the view scrolls (canFetchMore/fetchMore). Sorting and the
+    # item code filter run as indexed queries, so only the pages scrolled through are in memory.
+    page_size = 1000
+    db_order_by = ['item_code', 'cost']
+    col_names = ['item_code', 'cost_usd']
+    ru_col_names = ['Артикул', 'Себестоимость USD']
+    col_types = [str, float]
+
+    def __init__(self, db, *args, **kwargs):
         super(LoftCostsTableModel, self).__init__()
-        self._data = data or {}
-        self.col_names = ['item_code', 'cost_usd']
-        self.ru_col_names = ['Артикул', 'Себестоимость USD']
+        self.db = db
+        # loaded rows as parallel lists, plus item_code -> row lookup
+        self._item_codes = []
+        self._costs = []
+        self._rows = {}
+        self._has_more = False
+        self._sort_order = (0, Qt.SortOrder.AscendingOrder)
+        self._prefix = ''
 
     def data(self, index, role):
         if role == Qt.ItemDataRole.DisplayRole:
-            # See below for the nested-list data structure.
-            # .row() indexes into the outer list,
-            # .column() indexes into the sub-list
             if index.column() == 0:
-                value = list(self._data.keys())[index.row()]
-            else:
-                value = list(self._data.values())[index.row()]
-            return value
+                return self._item_codes[index.row()]
+            return self._costs[index.row()]
 
     def rowCount(self, index):
-        # The length of the outer list.
-        return len(self._data)
+        return len(self._item_codes)
 
     def columnCount(self, index):
-        # The following takes the first sub-list, and returns
-        # the length (only works if all rows are an equal length)
         return 2
 
     def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
@@ -320,43 +348,136 @@ class LoftCostsTableModel(QAbstractTableModel):
             return self.ru_col_names[section]
         return QAbstractTableModel.headerData(self, section, orientation, role)
 
-    def set_data_from_list(self, data):
-        if data:
-            for item in data:
-                self._data[item[0]] = item[1]
-        else:
-            data = {}
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._has_more
+
+    def fetchMore(self, parent):
+        if parent.isValid() or not self._has_more:
+            return
+        with timings.stage('fetch costs page') as fetch_stage:
+            rows = self._fetch_page(self._last_key(), self.page_size)
+            fetch_stage.rows = len(rows)
+            self._has_more = len(rows) == self.page_size
+            if not rows:
+                return
+            first_row = len(self._item_codes)
+            self.beginInsertRows(QModelIndex(), first_row, first_row + len(rows) - 1)
+            for item_code, cost in rows:
+                self._rows[item_code] = len(self._item_codes)
+                self._item_codes.append(item_code)
+                self._costs.append(cost)
+            self.endInsertRows()
+
+    def _fetch_page(self, after, limit):
+        column, order = self._sort_order
+        return self.db.get_costs_page(self.db_order_by[column], order == Qt.SortOrder.DescendingOrder,
+                                      self._prefix, after, limit)
+
+    def _last_key(self):
+        if not self._item_codes:
+            return None
+        column = self._sort_order[0]
+        return (self._item_codes[-1] if column == 0 else self._costs[-1]), self._item_codes[-1]
+
+    def refresh(self):
+        self.beginResetModel()
+        self._item_codes = []
+        self._costs = []
+        self._rows = {}
+        self._has_more = True
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self._sort_order = (column, order)
+        self.refresh()
+
+    def set_filter(self, prefix):
+        self._prefix = prefix.strip()
+        self.refresh()
+
+    def apply_changes(self, changed):
+        # (item_code, cost) rows written by an import. Loaded rows are patched in place, the first
+        # page is only reloaded when a changed row would move within or into the loaded rows.
+        by_cost = self._sort_order[0] == 1
+        descending = self._sort_order[1] == Qt.SortOrder.DescendingOrder
+        last_code = self._item_codes[-1] if self._item_codes else None
+        patched = []
+        for item_code, cost in changed:
+            # codes from the sheet may be numbers, the database stores them as text
+            item_code = str(item_code)
+            row = self._rows.get(item_code)
+            if row is None:
+                if not item_code.lower().startswith(self._prefix.lower()):
+                    continue
+                # a new row lands among the loaded ones unless it sorts after the last loaded row
+                if by_cost or not self._has_more or (item_code > last_code if descending else item_code < last_code):
+                    self.refresh()
+                    return
+            elif by_cost:
+                self.refresh()
+                return
+            else:
+                self._costs[row] = cost
+                patched.append(row)
+        if patched:
+            self.dataChanged.emit(self.index(min(patched), 1), self.index(max(patched), 1),
+                                  [Qt.ItemDataRole.DisplayRole])
 
     def update_item(self, item_code, cost_usd):
-        self._data[item_code] = cost_usd
+        row = self._rows.get(item_code)
+        if row is not None:
+            self._costs[row] = cost_usd
+            index = self.index(row, 1)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+    def iter_row_batches(self, batch_size=10000):
+        # every row matching the current sort and filter, not only the loaded pages
+        after = None
+        while True:
+            rows = self._fetch_page(after, batch_size)
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                break
+            after = (rows[-1][0] if self._sort_order[0] == 0 else rows[-1][1]), rows[-1][0]
 
     def get_items_list(self):
-        out = [[key, value] for key, value in self._data.items()]
-        return out
+        return [list(row) for batch in self.iter_row_batches() for row in batch]
 
     def save_costs_to_excel(self, excel_filepath):
-        df = pd.DataFrame(self.get_items_list(), columns=self.ru_col_names)
         try:
-            df.to_excel(excel_filepath, index=False)
+            export_rows(excel_filepath, self.ru_col_names, self.iter_row_batches(), self.col_types)
             return 0
         except:
             return 'Ошибка при сохранении файла'
 
 
 class MainWindow(QMainWindow):
+    # finished timings stages, re-emitted so records from worker threads reach the GUI thread
+    stage_finished = pyqtSignal(dict)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.sales_page_table = None
         self.sales_page_table_model = None
-        self.sales_page_table_proxy_model = None
         self.label_current_exchange_rate = None
+        self.sales_search = None
+        self.sales_filter_column = None
+        self.sales_filter_operator = None
+        self.sales_filter_value = None
 
+        self.costs_page = None
         self.costs_page_table = None
         self.costs_page_model = None
 
         self.db = DBInterface('test_db.sqlite')
+        self.report_cache = ReportCache('report_cache')
+        self.thread_pool = QThreadPool.globalInstance()
+        self.workers = []
         self.file_filter = 'Excel (*.xlsx)'
+        self.export_file_filter = 'Excel (*.xlsx);;CSV (*.csv);;Parquet (*.parquet)'
         self.exchange_rate = 0
         self.setWindowTitle('Calc')
         self.setGeometry(100, 100, 1100, 600)
@@ -365,10 +486,22 @@ class MainWindow(QMainWindow):
 
         # Define sales page, inside will be open button, exchange rate and read result table
         tab.addTab(self.assemble_sales_page(), 'Продажи')
-        tab.addTab(self.assemble_costs_page(), 'Себестоимость')
+        # the costs page is an empty container until the tab is first opened
+        self.costs_page = QWidget(self)
+        costs_page_layout = QVBoxLayout()
+        costs_page_layout.setContentsMargins(0, 0, 0, 0)
+        self.costs_page.setLayout(costs_page_layout)
+        tab.addTab(self.costs_page, 'Себестоимость')
+        tab.currentChanged.connect(self.tab_changed)
 
         self.setCentralWidget(tab)
         self.status_bar = self.statusBar()
+        self.btn_cancel_workers = QPushButton('Отмена', clicked=self.cancel_workers)
+        self.btn_cancel_workers.hide()
+        self.status_bar.addPermanentWidget(self.btn_cancel_workers)
+        self.label_timings = None
+        if timings.enabled:
+            self.assemble_timings_readout()
         self.show()
 
     def assemble_sales_page(self):
@@ -402,14 +535,39 @@ class MainWindow(QMainWindow):
         btn_layout.addWidget(self.label_current_exchange_rate)
         btn_layout.addWidget(btn_set_exchange_rate)
 
-        # creating table view, model and proxy model
+        # search by item code prefix plus one numeric condition, e.g. margin % < 0
+        sales_page_filter = QWidget(self)
+        filter_layout = QHBoxLayout()
+        sales_page_filter.setLayout(filter_layout)
+        self.sales_search = QLineEdit()
+        self.sales_search.setPlaceholderText('Поиск по артикулу')
+        self.sales_search.setFixedWidth(200)
+        self.sales_filter_column = QComboBox()
+        self.sales_filter_column.addItem('Без фильтра', None)
+        for col_name, ru_col_name in zip(LoftItem.col_names[1:], LoftItem.ru_col_names[1:]):
+            self.sales_filter_column.addItem(ru_col_name, col_name)
+        self.sales_filter_operator = QComboBox()
+        self.sales_filter_operator.addItems(['<', '<=', '>', '>=', '=', '!='])
+        self.sales_filter_value = QLineEdit()
+        self.sales_filter_value.setPlaceholderText('Значение')
+        self.sales_filter_value.setFixedWidth(100)
+        self.sales_search.textChanged.connect(self.filter_sales)
+        self.sales_filter_column.currentIndexChanged.connect(self.filter_sales)
+        self.sales_filter_operator.currentIndexChanged.connect(self.filter_sales)
+        self.sales_filter_value.textChanged.connect(self.filter_sales)
+        filter_layout.addWidget(self.sales_search)
+        filter_layout.addWidget(self.sales_filter_column)
+        filter_layout.addWidget(self.sales_filter_operator)
+        filter_layout.addWidget(self.sales_filter_value)
+        filter_layout.addStretch()
+
+        # creating table view and model, the model sorts itself so no proxy model is needed
         self.sales_page_table = QTableView()
         self.sales_page_table_model = LoftItemTableModel(self)
-        sales_page_table_proxy_model = QSortFilterProxyModel(self)
-
-        # connecting models and view together
-        sales_page_table_proxy_model.setSourceModel(self.sales_page_table_model)
-        self.sales_page_table.setModel(sales_page_table_proxy_model)
+        self.sales_page_table.setModel(self.sales_page_table_model)
+        # new filter results and merged reports are shown from the top, which also keeps the
+        # vertical header from re-laying out a scroll position past the end of the new rows
+        self.sales_page_table_model.modelReset.connect(self.sales_page_table.scrollToTop)
 
         # enable sort, default is item_code asc
         self.sales_page_table.setSortingEnabled(True)
@@ -419,9 +577,14 @@ class MainWindow(QMainWindow):
 
         # Packing buttons and table into page and page to tab widget
         page_layout.addWidget(sales_page_buttons)
+        page_layout.addWidget(sales_page_filter)
         page_layout.addWidget(self.sales_page_table)
         return sales_page
 
+    def tab_changed(self, index):
+        if self.costs_page_model is None and self.centralWidget().widget(index) is self.costs_page:
+            self.costs_page.layout().addWidget(self.assemble_costs_page())
+
     def assemble_costs_page(self):
         costs_page = QWidget(self)
         costs_page_layout = QVBoxLayout()
@@ -433,47 +596,141 @@ class MainWindow(QMainWindow):
 
         btn_costs_export = QPushButton('Экспорт', clicked=self.export_costs_to_file)
         btn_costs_import = QPushButton('Импорт', clicked=self.import_costs_from_file)
+        # every sheet of several supplier files at once, the plain import reads the first sheet only
+        btn_costs_import_sheets = QPushButton('Импорт всех листов', clicked=self.import_cost_sheets_from_files)
+        # item code prefix search, done by the database
+        costs_filter = QLineEdit()
+        costs_filter.setPlaceholderText('Поиск по артикулу')
+        costs_filter.setFixedWidth(200)
         btn_layout.addWidget(btn_costs_export)
         btn_layout.addWidget(btn_costs_import)
+        btn_layout.addWidget(btn_costs_import_sheets)
         btn_layout.addStretch()
+        btn_layout.addWidget(costs_filter)
 
         self.costs_page_table = QTableView()
-        self.costs_page_model = LoftCostsTableModel(self)
-        costs_page_proxy_model = QSortFilterProxyModel(self)
-
-        costs_page_proxy_model.setSourceModel(self.costs_page_model)
-        self.costs_page_table.setModel(costs_page_proxy_model)
+        self.costs_page_model = LoftCostsTableModel(self.db)
+        self.costs_page_table.setModel(self.costs_page_model)
+        costs_filter.textChanged.connect(self.costs_page_model.set_filter)
 
         self.costs_page_table.setSortingEnabled(True)
         self.costs_page_table.sortByColumn(0, Qt.SortOrder.AscendingOrder)
 
         self.resize_table(self.costs_page_table)
 
+        # sortByColumn has already loaded the first page of costs
         costs_page_layout.addWidget(costs_page_buttons)
         costs_page_layout.addWidget(self.costs_page_table)
-        self.load_costs_from_db()
         return costs_page
 
+    def assemble_timings_readout(self):
+        # latest outermost stage in the status bar, the recent stages with nesting in its tooltip
+        self.label_timings = QLabel('Замеры включены')
+        self.status_bar.addPermanentWidget(self.label_timings)
+        self.stage_finished.connect(self.show_timings)
+        timings.add_listener(self.emit_stage_finished)
+
+    def emit_stage_finished(self, record):
+        self.stage_finished.emit(record)
+
+    def show_timings(self, record):
+        if record['depth'] == 0:
+            self.label_timings.setText(timings.format_record(record))
+        self.label_timings.setToolTip('\n'.join('    ' * item['depth'] + timings.format_record(item)
+                                                for item in list(timings.records)[-25:]))
+
+    def start_worker(self, func, *args, on_finished=None, on_failed=None):
+        # pool threads are retired after 30s idle and later jobs get new ones, so the connection a
+        # job opened on its thread is closed with the job instead of being left open until exit
+        worker = Worker(func, *args, cleanup=self.db.close_connection)
+        worker.signals.progress.connect(self.status_bar.showMessage)
+        if on_finished:
+            worker.signals.finished.connect(on_finished)
+        if on_failed:
+            worker.signals.failed.connect(on_failed)
+        worker.signals.cancelled.connect(lambda: self.status_bar.showMessage('Операция отменена', 5000))
+        worker.signals.done.connect(lambda: self.worker_done(worker))
+        self.workers.append(worker)
+        self.btn_cancel_workers.show()
+        self.thread_pool.start(worker)
+        return worker
+
+    def worker_done(self, worker):
+        self.workers.remove(worker)
+        if not self.workers:
+            self.btn_cancel_workers.hide()
+
+    def cancel_workers(self):
+        if not self.workers:
+            return
+        for worker in self.workers:
+            worker.cancel()
+        self.status_bar.showMessage('Отмена...')
+
     def import_sales_from_file(self):
         filename, ok = QFileDialog.getOpenFileName(self,
                                                    "Выберите файл с продажами из 1С",
                                                    './',
                                                    self.file_filter)
         if filename and ok:
-            self.sales_page_table_model.read_sales_from_excel(filename)
-            self.sales_page_table_model.layoutChanged.emit()
+            self.start_worker(self.read_sales_job, filename,
+                              on_finished=self.sales_read_finished,
+                              on_failed=lambda error: QMessageBox.critical(self, 'Ошибка', 'Ошибка загрузки'))
+
+    def read_sales_job(self, worker, filename):
+        worker.report_progress('Чтение файла продаж...')
+        sales_store = self.report_cache.read_sales_from_excel(filename)
+        worker.report_progress('Файл продаж прочитан')
+        return sales_store
+
+    def sales_read_finished(self, sales_store):
+        with timings.stage('show sales', len(sales_store)):
+            self.sales_page_table_model.add_store(sales_store)
             self.resize_table(self.sales_page_table)
+            self.status_bar.showMessage(f'Загружено строк: {len(sales_store)}', 5000)
+
+    def get_export_filename(self):
+        filename, selected_filter = QFileDialog.getSaveFileName(self,
+                                                                "Укажите место сохранения файла",
+                                                                './',
+                                                                self.export_file_filter)
+        if filename and not path.splitext(filename)[1]:
+            # no extension typed, take it from the chosen filter, e.g. 'CSV (*.csv)'
+            filename += selected_filter[selected_filter.rindex('*') + 1:-1]
+        return filename
 
     def export_sales_to_file(self):
-        filename, ok = QFileDialog.getSaveFileName(self,
-                                                   "Укажите место сохранения файла",
-                                                   './',
-                                                   self.file_filter)
-        save_result = self.sales_page_table_model.save_sales_to_excel(filename)
-        if save_result != 0:
-            QMessageBox.critical(self, 'Ошибка', save_result)
-        else:
-            self.status_bar.showMessage('Сохранено успешно', 5000)
+        filename = self.get_export_filename()
+        if filename:
+            # rows are written from a copy of the columns, so the table stays usable meanwhile
+            sales_store = self.sales_page_table_model.snapshot()
+            self.start_worker(self.export_rows_job, filename, self.sales_page_table_model.ru_col_names,
+                              sales_store.iter_row_batches(), SalesStore.col_types,
+                              on_finished=self.save_finished, on_failed=self.save_failed)
+
+    @staticmethod
+    def export_rows_job(worker, filename, column_labels, row_batches, column_types=None):
+        def reported_batches():
+            rows_written = 0
+            for batch in row_batches:
+                yield batch
+                rows_written += len(batch)
+                worker.report_progress(f'Сохранение файла... {rows_written} строк')
+
+        worker.report_progress('Сохранение файла...')
+        try:
+            with timings.stage('export rows'):
+                export_rows(filename, column_labels, reported_batches(), column_types)
+        except WorkerCancelled:
+            if path.isfile(filename):
+                os.remove(filename)
+            raise
+
+    def save_finished(self, result):
+        self.status_bar.showMessage('Сохранено успешно', 5000)
+
+    def save_failed(self, error):
+        QMessageBox.critical(self, 'Ошибка', 'Ошибка при сохранении файла')
 
     def import_costs_from_file(self):
         filename, ok = QFileDialog.getOpenFileName(self,
@@ -481,38 +738,99 @@ class MainWindow(QMainWindow):
                                                    './',
                                                    self.file_filter)
         if filename and ok:
-            try:
+            self.start_worker(self.import_costs_job, filename,
+                              on_finished=self.costs_import_finished, on_failed=self.costs_import_failed)
+
+    def import_costs_job(self, worker, filename):
+        # pandas is slow to import and only needed here, so it is not loaded at startup
+        import pandas as pd
+
+        with timings.stage('import costs file'):
+            worker.report_progress('Чтение файла себестоимости...')
+            with timings.stage('read costs file') as read_stage:
                 df = pd.read_excel(filename, usecols=(0, 1))
                 df.iloc[:, 1] = df.iloc[:, 1].astype(float)
-                self.db.import_costs_to_db(df.values.tolist())
-                self.status_bar.showMessage('Import completed', 5000)
-            except ValueError:
-                # 'Cost column must contain only integer and float values!'
-                QMessageBox.critical(self, 'Ошибка', 'В столбце себестоимости должны быть только числа!')
-            except FileNotFoundError:
-                QMessageBox.critical(self, 'Ошибка', 'Файл не найден!')
-            except:
-                QMessageBox.critical(self, 'Ошибка', 'Ошибка загрузки')
-
-            self.load_costs_from_db()
+                read_stage.rows = len(df)
+            # last point where the import can be cancelled, the database write is one transaction
+            worker.report_progress('Запись себестоимости в базу...')
+            return self.db.import_costs_to_db(df.itertuples(index=False, name=None))
+
+    def import_cost_sheets_from_files(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self,
+                                                    "Выберите файлы с себестоимостью (все листы)",
+                                                    './',
+                                                    self.file_filter)
+        if filenames:
+            self.start_worker(self.import_cost_sheets_job, filenames,
+                              on_finished=self.cost_sheets_import_finished, on_failed=self.costs_import_failed)
+
+    def import_cost_sheets_job(self, worker, filenames):
+        with timings.stage('import costs files'):
+            # every sheet of every file is parsed in a separate process, a bad file or sheet
+            # ends up in the sheet results instead of failing the import
+            worker.report_progress('Чтение файлов себестоимости...')
+            rows, sheets = read_costs_files(filenames, progress=lambda done, total: worker.report_progress(
+                f'Прочитано листов: {done} из {total}'))
+            # last point where the import can be cancelled, the database write is one transaction
+            worker.report_progress('Запись себестоимости в базу...')
+            import_result = self.db.import_costs_to_db(rows)
+        import_result['sheets'] = sheets
+        return import_result
+
+    def costs_import_finished(self, import_result):
+        message = 'Import completed: {inserted} inserted, {updated} updated, {unchanged} unchanged'.format(**import_result)
+        if import_result['history_only']:
+            message += ', {history_only} only in history (newer costs in effect)'.format(**import_result)
+        self.status_bar.showMessage(message, 5000)
+        # only the rows the import actually changed are patched, in the costs page and the sales table
+        changed = import_result['changed']
+        if not changed:
+            return
+        if self.costs_page_model is not None:
+            self.costs_page_model.apply_changes(changed)
+        self.sales_page_table_model.apply_costs(changed)
+
+    def cost_sheets_import_finished(self, import_result):
+        self.costs_import_finished(import_result)
+        self.show_sheet_errors(import_result['sheets'])
+
+    def show_sheet_errors(self, sheets):
+        lines = []
+        for sheet in sheets:
+            place = os.path.basename(sheet['file'])
+            if sheet['sheet'] is not None:
+                place += f' [{sheet["sheet"]}]'
+            if sheet['error']:
+                lines.append(f'{place}: ошибка чтения ({sheet["error"]})')
+            elif sheet['invalid_rows']:
+                lines.append(f'{place}: пропущено строк без числовой себестоимости: {len(sheet["invalid_rows"])} '
+                             f'(строки {shown_rows(sheet["invalid_rows"])})')
+        if lines:
+            QMessageBox.warning(self, 'Загружено не всё', '\n'.join(lines[:20] + (['...'] if len(lines) > 20 else [])))
+
+    def costs_import_failed(self, error):
+        if isinstance(error, ValueError):
+            # 'Cost column must contain only integer and float values!'
+            QMessageBox.critical(self, 'Ошибка', 'В столбце себестоимости должны быть только числа!')
+        elif isinstance(error, FileNotFoundError):
+            QMessageBox.critical(self, 'Ошибка', 'Файл не найден!')
+        else:
+            QMessageBox.critical(self, 'Ошибка', 'Ошибка загрузки')
 
     def export_costs_to_file(self):
-        filename, ok = QFileDialog.getSaveFileName(self,
-                                                   "Укажите место сохранения файла",
-                                                   './',
-                                                   self.file_filter)
-        save_result = self.costs_page_model.save_costs_to_excel(filename)
-        if save_result != 0:
-            QMessageBox.critical(self, 'Ошибка', save_result)
-        else:
-            self.status_bar.showMessage('Сохранено успешно', 5000)
+        filename = self.get_export_filename()
+        if filename:
+            # streamed straight from SQLite on the worker's own connection
+            self.start_worker(self.export_rows_job, filename, LoftCostsTableModel.ru_col_names,
+                              self.db.iter_costs(), LoftCostsTableModel.col_types,
+                              on_finished=self.save_finished, on_failed=self.save_failed)
 
     def set_exchange_rate(self):
         exchange_rate, ok = QInputDialog.getDouble(self, f'Текущий курс: {self.exchange_rate}', 'Новый курс:')
         if exchange_rate and ok:
             self.db.set_usd_exchange_rate(exchange_rate)
             self.get_exchange_rate_from_db()
-            self.sales_fill_costs()
+            self.sales_page_table_model.recalculate_cost_rub()
             self.status_bar.showMessage('Курс успешно обновлен', 5000)
 
     def get_exchange_rate_from_db(self):
@@ -520,23 +838,55 @@ class MainWindow(QMainWindow):
         self.label_current_exchange_rate.setText(f'Текущий курс: {self.exchange_rate}')
         LoftItem.usd_rub_rate = self.exchange_rate
 
+    def filter_sales(self):
+        conditions = []
+        col_name = self.sales_filter_column.currentData()
+        value = self.sales_filter_value.text().strip().replace(',', '.')
+        if col_name and value:
+            try:
+                conditions.append((col_name, self.sales_filter_operator.currentText(), float(value)))
+            except ValueError:
+                # half-typed number, keep only the item code search
+                pass
+        self.sales_page_table_model.set_filter(self.sales_search.text(), conditions)
+
     def sales_fill_costs(self):
-        self.db.fill_cost_from_db(self.sales_page_table_model)
-        self.resize_table(self.sales_page_table)
+        with timings.stage('fill costs'):
+            self.db.fill_cost_from_db(self.sales_page_table_model)
+            self.resize_table(self.sales_page_table)
 
-    def load_costs_from_db(self):
-        self.costs_page_model.set_data_from_list(self.db.get_costs_from_db())
-        self.costs_page_model.layoutChanged.emit()
-        self.resize_table(self.costs_page_table)
+    def closeEvent(self, event):
+        self.cancel_workers()
+        self.thread_pool.waitForDone()
+        if self.label_timings is not None:
+            timings.remove_listener(self.emit_stage_finished)
+        self.db.close()
+        super().closeEvent(event)
 
     @staticmethod
     def resize_table(table):
-        table.resizeColumnsToContents()
+        with timings.stage('resize columns'):
+            table.horizontalHeader().setResizeContentsPrecision(RESIZE_SAMPLE_ROWS)
+            table.resizeColumnsToContents()
+
+
+def parse_args(argv):
+    # options for the app itself, everything else is left to Qt
+    parser = argparse.ArgumentParser(description='Loft margin calculator')
+    parser.add_argument('--timings', action='store_true', help='show per-stage timings in the status bar')
+    parser.add_argument('--timings-log', help='also append every stage to this JSON lines file')
+    parser.add_argument('--profile-dir', help='write a cProfile .prof file per outermost stage into this directory')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record peak Python memory per stage (slows everything down)')
+    return parser.parse_known_args(argv[1:])
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    args, qt_args = parse_args(sys.argv)
+    if args.timings or args.timings_log or args.profile_dir or args.trace_memory:
+        timings.enable(args.timings_log, args.profile_dir, args.trace_memory)
+    app = QApplication(sys.argv[:1] + qt_args)
     window = MainWindow()
     window.show()
     sys.exit(app.exec())
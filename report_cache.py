@@ -0,0 +1,88 @@
+import hashlib
+import os
+
+import timings
+from sales_store import PARSER_VERSION, SalesStore, read_sales_from_excel
+
+
+class ReportCache:
+    # Parsed sales reports stored as .npz files, keyed by parser version, file size, mtime and
+    # content hash. Files are touched on every hit and the least recently used ones are removed
+    # once the cache grows over max_bytes.
+    def __init__(self, cache_dir, max_bytes=256 * 2 ** 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, excel_filepath):
+        stat = os.stat(excel_filepath)
+        digest = hashlib.sha1(f'{PARSER_VERSION}:{stat.st_size}:{stat.st_mtime_ns}:'.encode())
+        with open(excel_filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def read_sales_from_excel(self, excel_filepath):
+        with timings.stage('read sales report') as read_stage:
+            with timings.stage('hash report'):
+                cache_path = self.cache_path(self.key(excel_filepath))
+            with timings.stage('load cached report'):
+                sales_store = self.get(cache_path)
+            if sales_store is None:
+                sales_store = read_sales_from_excel(excel_filepath)
+                with timings.stage('write report cache'):
+                    self.put(cache_path, sales_store)
+            read_stage.rows = len(sales_store)
+        return sales_store
+
+    def get(self, cache_path):
+        try:
+            sales_store = SalesStore.load(cache_path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # unreadable entry, parse the report again and overwrite it
+            self.remove(cache_path)
+            return None
+        os.utime(cache_path)
+        return sales_store
+
+    def put(self, cache_path, sales_store):
+        # the cache is only an accelerator, failing to write it must not fail the read
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                sales_store.save(file)
+            os.replace(tmp_path, cache_path)
+            self.evict()
+        except OSError:
+            pass
+
+    def remove(self, cache_path):
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npz'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total_size = sum(entry[1] for entry in entries)
+        for mtime, size, cache_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            self.remove(cache_path)
+            total_size -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npz'):
+                    self.remove(os.path.join(self.cache_dir, name))
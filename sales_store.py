@@ -0,0 +1,397 @@
+from array import array
+
+import numpy as np
+
+import timings
+
+# bump whenever read_sales_from_excel starts producing different tables, cached reports are keyed by it
+PARSER_VERSION = 2
+
+# first column values that start the report and mark its totals rows
+START_TRIGGER_VALUE = "Номенклатура"
+TOTAL_TRIGGER_VALUE = "Итого"
+
+# comparisons allowed in SalesStore.filter_rows conditions
+filter_operators = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '=': np.equal,
+    '!=': np.not_equal,
+}
+
+
+class SalesStore:
+    col_names = ['item_code', 'sold_qty', 'sold_price', 'sold_sum',
+                 'cost_rub', 'cost_usd', 'margin_rub', 'margin_pct']
+    ru_col_names = ['Артикул', 'Количество продано', 'Средняя цена продажи', 'Сумма продано',
+                    'Себестоимость РУБ', 'Себестоимость USD', 'Маржинальность РУБ/шт', 'Маржинальность %']
+    # value types of the exported columns
+    col_types = [str, int, float, float, float, float, float, float]
+    col_dtypes = {
+        'item_code': object,
+        'sold_qty': np.int64,
+        'sold_price': np.float64,
+        'sold_sum': np.float64,
+        'cost_rub': np.float64,
+        'cost_usd': np.float64,
+        'margin_rub': np.float64,
+        'margin_pct': np.float64,
+    }
+
+    def __init__(self):
+        self.columns = {name: np.empty(0, dtype=self.col_dtypes[name]) for name in self.col_names}
+        self._row_index = None
+        self._code_index = None
+
+    def __len__(self):
+        return len(self.columns['item_code'])
+
+    def __getitem__(self, col_name):
+        return self.columns[col_name]
+
+    def copy(self):
+        store = SalesStore()
+        store.columns = {name: column.copy() for name, column in self.columns.items()}
+        return store
+
+    def clear(self):
+        self.columns = {name: np.empty(0, dtype=self.col_dtypes[name]) for name in self.col_names}
+        self._row_index = None
+        self._code_index = None
+
+    def append(self, item_codes, sold_qty, sold_sum):
+        item_codes = np.asarray(item_codes, dtype=object)
+        sold_qty = np.asarray(sold_qty, dtype=np.int64)
+        sold_sum = np.asarray(sold_sum, dtype=np.float64)
+        zeros = np.zeros(len(item_codes), dtype=np.float64)
+
+        # same rule as LoftItem: no sold qty means no average price
+        sold_price = np.divide(sold_sum, sold_qty, out=zeros.copy(), where=sold_qty != 0)
+
+        self._concatenate({
+            'item_code': item_codes,
+            'sold_qty': sold_qty,
+            'sold_price': sold_price,
+            'sold_sum': sold_sum,
+            'cost_rub': zeros.copy(),
+            'cost_usd': zeros.copy(),
+            'margin_rub': zeros.copy(),
+            'margin_pct': zeros.copy(),
+        })
+
+    def extend(self, other):
+        self._concatenate(other.columns)
+
+    def _concatenate(self, new_columns):
+        for name in self.col_names:
+            self.columns[name] = np.concatenate((self.columns[name], new_columns[name]))
+        self._row_index = None
+        self._code_index = None
+
+    def set_cost_usd(self, rows, cost_usd):
+        self.columns['cost_usd'][rows] = cost_usd
+
+    def recalculate(self, usd_rub_rate, rows=None):
+        # Mirrors LoftItem.calculate_cost_rub: rows without usd cost (or with no rate set) keep
+        # their previous values, margins are only touched for rows that actually sold something
+        if usd_rub_rate <= 0:
+            return
+        if rows is None:
+            rows = slice(None)
+
+        cost_usd = self.columns['cost_usd'][rows]
+        sold_qty = self.columns['sold_qty'][rows]
+        sold_price = self.columns['sold_price'][rows]
+
+        with_cost = cost_usd > 0
+        cost_rub = np.where(with_cost, cost_usd * usd_rub_rate, self.columns['cost_rub'][rows])
+        self.columns['cost_rub'][rows] = cost_rub
+
+        with_margin = with_cost & (sold_qty != 0)
+        margin_rub = np.where(with_margin, sold_price - cost_rub, self.columns['margin_rub'][rows])
+        safe_cost_rub = np.where(with_margin, cost_rub, 1)
+        margin_pct = np.where(with_margin, margin_rub * 100 / safe_cost_rub, self.columns['margin_pct'][rows])
+        self.columns['margin_rub'][rows] = margin_rub
+        self.columns['margin_pct'][rows] = margin_pct
+
+    def sort(self, col_name, descending=False):
+        key = self.columns[col_name]
+        if key.dtype == object:
+            key = key.astype(str)
+        order = np.argsort(key, kind='stable')
+        if descending:
+            order = order[::-1]
+        for name in self.col_names:
+            self.columns[name] = self.columns[name][order]
+        self._row_index = None
+        self._code_index = None
+        return order
+
+    @property
+    def row_index(self):
+        # str(item_code) -> row of its first occurrence, rebuilt lazily after append/sort. Codes are
+        # keyed as the database's TEXT column stores them, so numeric codes read from a report
+        # (100200) match the '100200' coming back from SQLite.
+        if self._row_index is None:
+            self._row_index = {}
+            for row, item_code in enumerate(self.columns['item_code'].tolist()):
+                self._row_index.setdefault(str(item_code), row)
+        return self._row_index
+
+    @property
+    def code_index(self):
+        # (lowercased item codes in sorted order, their rows), so a prefix is two binary searches
+        if self._code_index is None:
+            codes = np.array([str(item_code).lower() for item_code in self.columns['item_code'].tolist()], dtype=str)
+            order = np.argsort(codes, kind='stable')
+            self._code_index = (codes[order], order)
+        return self._code_index
+
+    def prefix_rows(self, prefix):
+        # unsorted rows whose item code starts with prefix, case-insensitive
+        codes, order = self.code_index
+        prefix = str(prefix).lower()
+        first = np.searchsorted(codes, prefix, side='left')
+        last = np.searchsorted(codes, prefix + '\U0010ffff', side='left')
+        return order[first:last]
+
+    def filter_rows(self, prefix='', conditions=()):
+        # Rows matching an item code prefix and every (col_name, operator, value) condition, in
+        # table order. Each condition is a single comparison over the whole column.
+        mask = np.ones(len(self), dtype=bool)
+        if prefix:
+            mask[:] = False
+            mask[self.prefix_rows(prefix)] = True
+        for col_name, operator, value in conditions:
+            mask &= filter_operators[operator](self.columns[col_name], value)
+        return np.flatnonzero(mask)
+
+    def apply_costs(self, items_costs, usd_rub_rate):
+        # items_costs: (item_code, cost_usd) pairs, returns the rows that were updated. Empty costs
+        # (NULL in the database) are skipped.
+        found = [(row, item[1]) for row, item in zip(self.find_rows([item[0] for item in items_costs]), items_costs)
+                 if row is not None and item[1] is not None]
+        rows = np.fromiter((item[0] for item in found), dtype=np.int64, count=len(found))
+        if not len(rows):
+            return rows
+        self.set_cost_usd(rows, np.fromiter((item[1] for item in found), dtype=np.float64, count=len(found)))
+        self.recalculate(usd_rub_rate, rows)
+        return rows
+
+    def find_row(self, item_code):
+        return self.row_index.get(str(item_code))
+
+    def find_rows(self, item_codes):
+        row_index = self.row_index
+        return [row_index.get(str(item_code)) for item_code in item_codes]
+
+    def value(self, row, column):
+        # ndarray.item converts straight to a python value, without a numpy scalar in between
+        return self.columns[self.col_names[column]].item(row)
+
+    def get_row(self, row):
+        return [self.value(row, column) for column in range(len(self.col_names))]
+
+    def get_rows(self):
+        columns = [self.columns[name].tolist() for name in self.col_names]
+        return [list(row) for row in zip(*columns)]
+
+    def iter_row_batches(self, batch_size=10000):
+        for start in range(0, len(self), batch_size):
+            columns = [self.columns[name][start:start + batch_size].tolist() for name in self.col_names]
+            yield list(zip(*columns))
+
+    def save(self, file):
+        np.savez(file, **self.columns)
+
+    @classmethod
+    def load(cls, file):
+        store = cls()
+        with np.load(file, allow_pickle=True) as saved:
+            store.columns = {name: saved[name].astype(store.col_dtypes[name], copy=False) for name in store.col_names}
+        return store
+
+    def to_frame(self, column_labels=None):
+        import pandas as pd
+
+        return pd.DataFrame({label: self.columns[name].copy()
+                             for name, label in zip(self.col_names, column_labels or self.col_names)})
+
+
+def aggregate_sales(stores, labels=None, group_by=(), usd_rub_rate=0):
+    # Merges any number of sales tables into one row per item_code with summed qty and sum, so
+    # sold_price becomes the qty-weighted average. With group_by, labels holds one dict per store
+    # (e.g. {'source': ..., 'store': ..., 'period': ...}) and a dict {group key tuple: SalesStore}
+    # is returned instead. Known usd costs are carried over and margins recalculated.
+    with timings.stage('aggregate sales') as aggregate_stage:
+        results = _aggregate_sales(list(stores), labels, group_by, usd_rub_rate)
+        aggregate_stage.rows = sum(len(store) for store in results.values())
+    if not group_by:
+        return results[()]
+    return results
+
+
+def _aggregate_sales(stores, labels, group_by, usd_rub_rate):
+    import pandas as pd
+
+    sizes = [len(store) for store in stores]
+    columns = {name: np.concatenate([store[name] for store in stores] or [np.empty(0, SalesStore.col_dtypes[name])])
+               for name in ('item_code', 'sold_qty', 'sold_sum', 'cost_usd')}
+    # items are grouped by str(item_code) like the database keys them, so 100200 and '100200' are
+    # one item, shown with the code it first appeared with
+    code_ids = pd.factorize(columns['item_code'].astype(str))[0]
+    first_rows = np.unique(code_ids, return_index=True)[1]
+    item_codes = columns['item_code'][first_rows]
+
+    if group_by:
+        group_keys, store_group_ids = [], []
+        for label in labels:
+            group_key = tuple(label.get(key) for key in group_by)
+            if group_key not in group_keys:
+                group_keys.append(group_key)
+            store_group_ids.append(group_keys.index(group_key))
+        row_group_ids = np.repeat(np.array(store_group_ids, dtype=np.int64), sizes)
+        row_ids, pairs = pd.factorize(row_group_ids * len(item_codes) + code_ids)
+        result_groups, result_codes = np.divmod(pairs, max(len(item_codes), 1))
+    else:
+        row_ids = code_ids
+        result_groups = np.zeros(len(item_codes), dtype=np.int64)
+        result_codes = np.arange(len(item_codes))
+        group_keys = [()]
+
+    result_rows = len(result_codes)
+    sold_qty = np.bincount(row_ids, weights=columns['sold_qty'], minlength=result_rows).round().astype(np.int64)
+    sold_sum = np.bincount(row_ids, weights=columns['sold_sum'], minlength=result_rows)
+    # the same item has the same cost in every report, zeros (not filled yet) never win
+    cost_usd = np.zeros(result_rows, dtype=np.float64)
+    np.maximum.at(cost_usd, row_ids, columns['cost_usd'])
+
+    results = {}
+    for group_id, group_key in enumerate(group_keys):
+        rows = np.flatnonzero(result_groups == group_id) if group_by else slice(None)
+        store = SalesStore()
+        store.append(np.asarray(item_codes, dtype=object)[result_codes[rows]], sold_qty[rows], sold_sum[rows])
+        store.set_cost_usd(slice(None), cost_usd[rows])
+        store.recalculate(usd_rub_rate)
+        results[group_key] = store
+    return results
+
+
+def read_sales_from_excel(excel_filepath):
+    # One read-only pass over the first sheet: rows up to the "Номенклатура" header are skipped,
+    # the report starts at the first row after it with a value in the first column, and only
+    # the name, item code, quantity and sum cells of each row are kept.
+    from openpyxl import load_workbook
+
+    with timings.stage('scan report sheet') as scan_stage:
+        workbook = load_workbook(excel_filepath, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            report = _scan_report(_report_rows(sheet))
+            if report is None:
+                # a column the first row left empty has values further down, so the fields are
+                # chosen from every report row first and the sheet is read again
+                report = _scan_report(_report_rows(sheet), _report_columns(_report_rows(sheet)))
+        finally:
+            workbook.close()
+        names, item_codes, sold_qty, sold_sum = report
+        scan_stage.rows = len(names)
+
+    with timings.stage('build sales store', len(names)):
+        store = SalesStore()
+        if not names:
+            return store
+        order = np.argsort(np.array(names, dtype=object).astype(str), kind='stable')
+        del names
+        item_codes = np.array(item_codes, dtype=object)
+        sold_qty = np.frombuffer(sold_qty, dtype=np.float64).astype(np.int64)
+        sold_sum = np.frombuffer(sold_sum, dtype=np.float64)
+        store.append(item_codes[order], sold_qty[order], sold_sum[order])
+        return store
+
+
+def _report_rows(sheet):
+    # rows from the report start on, or everything under the first row without a "Номенклатура" header
+    rows = sheet.iter_rows(min_row=2, values_only=True)
+    for row in rows:
+        if row and row[0] == START_TRIGGER_VALUE:
+            break
+    else:
+        yield from sheet.iter_rows(min_row=2, values_only=True)
+        return
+    for row in rows:
+        if row and row[0] is not None and row[0] != START_TRIGGER_VALUE:
+            yield row
+            break
+    yield from rows
+
+
+def _has_values(row):
+    return any(value is not None for value in row)
+
+
+def _scan_report(rows, report_columns=None):
+    # -> (names, item_codes, sold_qty, sold_sum). The report fields are the first four columns with
+    # a value in any report row, as the old dropna(axis=1) kept them. Without report_columns they
+    # are taken from the first row, and None is returned once a column it left empty turns up
+    # with a value further down.
+    # Numbers go straight into typed arrays, empty cells become 0 as before.
+    names, item_codes, sold_qty, sold_sum = [], [], array('d'), array('d')
+    gaps = ()
+    row_number = last_value_row = 0
+    totals = []
+    for row in rows:
+        row_number += 1
+        if not _has_values(row):
+            continue
+        last_value_row = row_number
+        if report_columns is None:
+            report_columns = [column for column, value in enumerate(row) if value is not None][:4]
+            if len(report_columns) < 4:
+                return None
+            gaps = [column for column in range(report_columns[-1]) if column not in report_columns]
+        if gaps and any(column < len(row) and row[column] is not None for column in gaps):
+            return None
+        if row[0] == TOTAL_TRIGGER_VALUE:
+            totals.append((len(names), row_number))
+        name, item_code, qty, amount = [row[column] if column < len(row) else None for column in report_columns]
+        names.append(0 if name is None else name)
+        item_codes.append(0 if item_code is None else item_code)
+        sold_qty.append(0 if qty is None else float(qty))
+        sold_sum.append(0 if amount is None else float(amount))
+
+    # "Итого" rows are only dropped among the last ten rows up to the last one with a value,
+    # as they always were
+    for position, number in reversed(totals):
+        if number > last_value_row - 10:
+            for column in (names, item_codes, sold_qty, sold_sum):
+                del column[position]
+    return names, item_codes, sold_qty, sold_sum
+
+
+def _report_columns(rows):
+    # the first four columns with a value in a report row, not counting the "Итого" rows dropped
+    # at the end. Missing columns are read as empty cells.
+    counts = {}
+    totals = []
+    row_number = last_value_row = 0
+    for row in rows:
+        row_number += 1
+        if not _has_values(row):
+            continue
+        last_value_row = row_number
+        columns = [column for column, value in enumerate(row) if value is not None]
+        if row[0] == TOTAL_TRIGGER_VALUE:
+            totals.append((row_number, columns))
+            continue
+        for column in columns:
+            counts[column] = counts.get(column, 0) + 1
+    for number, columns in totals:
+        if number <= last_value_row - 10:
+            for column in columns:
+                counts[column] = counts.get(column, 0) + 1
+    used = sorted(counts)
+    width = used[-1] + 1 if used else 0
+    return (used + list(range(width, width + 4)))[:4]
@@ -0,0 +1,160 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Per-stage wall time, row counts and (optionally) peak memory for the slow paths:
+#
+#     with timings.stage('fill costs') as stage:
+#         ...
+#         stage.rows = len(items_costs)
+#
+# Disabled by default. stage() then hands out one shared no-op object, so instrumented code
+# costs a function call and a flag check. Once enabled, every finished stage is kept in
+# `records`, passed to the listeners, optionally appended to a JSON lines log, and outermost
+# stages can be profiled with cProfile, one .prof file each.
+enabled = False
+records = deque(maxlen=200)
+
+_log_path = None
+_profile_dir = None
+_listeners = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def rows(self):
+        return None
+
+    @rows.setter
+    def rows(self, rows):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+class Stage:
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.depth = 0
+        self.peak_bytes = 0
+        self.started = 0
+        self.profile = None
+
+    def __enter__(self):
+        stack = _stack()
+        self.depth = len(stack)
+        if tracemalloc.is_tracing():
+            # the parent's peak so far is saved before the peak is reset for this stage
+            if stack:
+                stack[-1].peak_bytes = max(stack[-1].peak_bytes, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if _profile_dir and not stack:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # newer Pythons allow a single active profiler, a stage on another thread has it
+                self.profile = None
+        stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.started
+        stack = _stack()
+        stack.pop()
+        if self.profile is not None:
+            self.profile.disable()
+        record = {
+            'stage': self.name,
+            'seconds': round(seconds, 6),
+            'rows': self.rows,
+            'depth': self.depth,
+            'thread': threading.current_thread().name,
+            'failed': exc_type is not None,
+        }
+        if tracemalloc.is_tracing():
+            self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = round(self.peak_bytes / 2 ** 20, 1)
+            if stack:
+                stack[-1].peak_bytes = max(stack[-1].peak_bytes, self.peak_bytes)
+        _finish(record, self.profile)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _finish(record, profile):
+    with _lock:
+        records.append(record)
+        if profile is not None:
+            filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{len(records)}-{record["stage"].replace(" ", "_")}.prof'
+            profile.dump_stats(os.path.join(_profile_dir, filename))
+        if _log_path:
+            with open(_log_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(dict(record, at=time.time(), pid=os.getpid()), ensure_ascii=False) + '\n')
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(record)
+
+
+def stage(name, rows=None):
+    if not enabled:
+        return _null_stage
+    return Stage(name, rows)
+
+
+def enable(log_path=None, profile_dir=None, trace_memory=False):
+    # trace_memory makes peak memory per stage available, at the cost of slowing down every allocation
+    global enabled, _log_path, _profile_dir
+    _log_path = log_path
+    _profile_dir = profile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def add_listener(listener):
+    # called with every finished stage record, from the thread the stage ran in
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def format_record(record):
+    text = f'{record["stage"]}: {record["seconds"]:.3f}s'
+    if record['rows'] is not None:
+        text += f', {record["rows"]} rows'
+    if 'peak_mb' in record:
+        text += f', {record["peak_mb"]} MB'
+    return text